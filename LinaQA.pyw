@@ -12,10 +12,8 @@ Usage: python LinaQA.pyw
 # SPDX-License-Identifier: Licence.txt:
 
 import sys
-import inspect
 import os.path as osp
 import os
-import io
 import math
 from pylinac.core.io import TemporaryZipDirectory
 from platform import system
@@ -27,7 +25,11 @@ from PyQt5.QtWidgets import (
      QLabel,
      QAction,
      QInputDialog,
-     QHeaderView)
+     QHeaderView,
+     QComboBox,
+     QWidget,
+     QVBoxLayout,
+     QPlainTextEdit)
 from PyQt5.QtGui import (
      QGuiApplication,
      QPixmap,
@@ -36,10 +38,9 @@ from PyQt5.QtGui import (
      QFont,
      QMouseEvent,
      QStandardItemModel,
-     QStandardItem,
-     QCursor)
-from PyQt5.QtCore import Qt, QSettings, QSortFilterProxyModel
-import matplotlib.pyplot as plt
+     QStandardItem)
+from PyQt5.QtCore import Qt, QSettings, QSortFilterProxyModel, QStandardPaths, QThreadPool
+import matplotlib
 import webbrowser
 
 from LinaQAForm import Ui_LinaQAForm
@@ -50,31 +51,25 @@ from aboutpackage import About
 from aboutpackage.aboutform import version
 from settingsunit import set_default_settings
 from imageunit import Imager
+from loaderunit import scan_series, read_series, copy_dataset
+from catalogunit import open_catalog
+from workerunit import AnalysisWorker
+from cacheunit import ResultCache
+import analysisunit
+import pfbatchunit
 from decorators import show_wait_cursor, check_valid_image, catch_nm_type_error
 from misc_utils import (
     open_path,
     get_dot_attr,
     set_dot_attr,
     del_dot_attr,
-    text_to_tag,
-    dataset_to_stream,
-    datasets_to_stream)
+    text_to_tag)
 from popups import create_popups, initialize_popups, update_popups
 import pylinac_subclasses
 from tablemodel import TableModel
 
 import pydicom
-from pylinac.core import pdf
-from pylinac.core.image import DicomImageStack
 from pylinac import (
-    image,
-    picketfence,
-    ct,
-    winston_lutz,
-    planar_imaging,
-    vmat,
-    starshot,
-    log_analyzer,
     QuartDVT,
     ACRCT,
     ACRMRILarge)
@@ -90,6 +85,10 @@ class LinaQA(QMainWindow):
         self.changed = False
         self.mouse_last_pos = None
         self.filenames = []
+        self.series = []
+        self.series_imagers = {}
+        self.num_rejected = 0
+        self.force_read = False
         self.ref_filename = ""
         self.working_dir = ""
         self.zip_dir = None
@@ -98,6 +97,12 @@ class LinaQA(QMainWindow):
         self.table_model = None
         self.is_changed = False
         self.old_tab = 0
+        self.worker = None
+        self.thread_pool = QThreadPool()
+        # reports are drawn one at a time off the GUI thread, so pyplot must not use an interactive backend
+        matplotlib.use("Agg")
+        self.report_pool = QThreadPool()
+        self.report_pool.setMaxThreadCount(1)
         self.ui = Ui_LinaQAForm()
         self.ui.setupUi(self)
         self.settings = QSettings()
@@ -106,6 +111,10 @@ class LinaQA(QMainWindow):
         if self.settings.contains("Window/Position"):
             self.move(self.settings.value("Window/Position"))
         set_default_settings(self.settings)
+        self.catalog = None
+        if self.settings.value("PyDicom/Use catalog", True, type=bool):
+            self.catalog = open_catalog(QStandardPaths.writableLocation(QStandardPaths.AppLocalDataLocation))
+        self.result_cache = ResultCache(self.settings.value("General/Result cache MB", 512, type=float))
 
         # set toolbar icon text
         if self.settings.value("Window/Show icon text", True, type=bool):
@@ -128,6 +137,23 @@ class LinaQA(QMainWindow):
         action_close.setText("E&xit")
         self.ui.menubar.addAction(action_close)
 
+        # all the open picket fence images can be analysed together from the Radiotherapy menu
+        self.ui.action_Picket_Fence_batch = QAction("Picket Fence batch", self.ui.menuRadiotherapy)
+        self.ui.action_Picket_Fence_batch.setToolTip("Analyse all open picket fence images and tabulate leaf errors")
+        self.ui.menuRadiotherapy.insertAction(self.ui.action_VMAT, self.ui.action_Picket_Fence_batch)
+
+        # the results cache can be cleared from the Edit menu
+        self.ui.action_Clear_cache = QAction("Clear results cache", self.ui.menuEdit)
+        self.ui.action_Clear_cache.setToolTip("Forget previous analysis results so the next analysis is run afresh")
+        self.ui.menuEdit.insertAction(self.ui.action_Settings, self.ui.action_Clear_cache)
+
+        # add series selector to the main toolbar, it is only shown if more than one series is open
+        self.ui.cbSeries = QComboBox()
+        self.ui.cbSeries.setToolTip("Select the series to display")
+        self.ui.cbSeries.setSizeAdjustPolicy(QComboBox.AdjustToContents)
+        self.ui.action_Series = self.ui.toolBar_Left.addWidget(self.ui.cbSeries)
+        self.ui.action_Series.setVisible(False)
+
         # add actions to treeView
         self.ui.treeView.addAction(self.ui.action_Copy)
         self.ui.treeView.addAction(self.ui.action_Select_all)
@@ -152,9 +178,12 @@ class LinaQA(QMainWindow):
         self.ui.action_PylinacH.triggered.connect(self.pylinac_help)
         action_close.triggered.connect(self.close)
         self.ui.action_Settings.triggered.connect(self.show_settings)
+        self.ui.cbSeries.currentIndexChanged.connect(self.select_series)
+        self.ui.statusbar.cancel_requested.connect(self.cancel_analysis)
         # RX toolbar
         self.ui.action_CatPhan.triggered.connect(self.analyse_catphan)
         self.ui.action_Picket_Fence.triggered.connect(self.analyse_picket_fence)
+        self.ui.action_Picket_Fence_batch.triggered.connect(self.analyse_picket_fence_batch)
         self.ui.action_Winston_Lutz.triggered.connect(self.analyse_winston_lutz)
         self.ui.action_2DPhantoms.triggered.connect(self.analyse_2d_phantoms)
         self.ui.action_Starshot.triggered.connect(self.analyse_star)
@@ -188,6 +217,7 @@ class LinaQA(QMainWindow):
         self.ui.action_Edit_tag.triggered.connect(self.edit_tag)
         self.ui.action_Delete_tag.triggered.connect(self.del_tag)
         self.ui.action_Notes.triggered.connect(self.show_notes)
+        self.ui.action_Clear_cache.triggered.connect(self.clear_result_cache)
 
         # connect treeView actions
         self.ui.action_Copy.triggered.connect(self.copy_tag)
@@ -206,6 +236,15 @@ class LinaQA(QMainWindow):
         self.ui.tabWidget.setTabVisible(3, False)
         self.ui.tabWidget.setTabVisible(4, False)
         self.ui.tabWidget.setTabVisible(5, False)
+        # results tab to show the results summary while the report is written
+        self.ui.tab_results = QWidget()
+        self.ui.verticalLayout_results = QVBoxLayout(self.ui.tab_results)
+        self.ui.pte_results = QPlainTextEdit(self.ui.tab_results)
+        self.ui.pte_results.setReadOnly(True)
+        self.ui.pte_results.setFont(QFont("Monospace"))
+        self.ui.verticalLayout_results.addWidget(self.ui.pte_results)
+        self.ui.tabWidget.addTab(self.ui.tab_results, "Results")
+        self.ui.tabWidget.setTabVisible(6, False)
         self.ui.action_Scale_LUT.setChecked(self.settings.value("PyDicom/Use rescale", False, type=bool))
         self.ui.action_Rx_Toolbar.setChecked(self.settings.value("Window/Show Rx Toolbar", True, type=bool))
         self.show_rx_toolbar()
@@ -230,83 +269,88 @@ class LinaQA(QMainWindow):
                 event.accept()
             else:
                 event.ignore()
+        if event.isAccepted() and self.worker is not None:
+            self.worker.cancel()
+            self.thread_pool.waitForDone()
+        if event.isAccepted():
+            self.report_pool.waitForDone()
+        if event.isAccepted() and self.catalog is not None:
+            self.catalog.close()
 
     def open_image(self, filenames, force_read: bool = False):
-        num_total = len(filenames)
-        num_bad = 0
-        first_modality = ""
-        frames = 0
-        sorted_method = "None"
-
-        # Clear non-dicom files
-        datasets = []
-        # we have to treat the first file separately to get the image modality
-        try:
-            ds = pydicom.dcmread(filenames[0], force=force_read)
-            if "TransferSyntaxUID" not in ds.file_meta:
-                ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
-            if "SpacingBetweenSlices" not in ds:
-                ds.SpacingBetweenSlices = ds.SliceThickness if "SliceThickness" in ds else 1
-            if "Modality" in ds:
-                first_modality = ds.Modality
-            frames = ds.NumberOfFrames if "NumberOfFrames" in ds else 1
-            if ds.file_meta.TransferSyntaxUID.is_compressed:
-                ds.decompress()
-            datasets.append(ds)
-        except pydicom.errors.InvalidDicomError:
-            num_bad += 1
-            filenames.remove(filenames[0])
-        num_ok = 1
-
-        # continue reading if first image is a single frame image
-        if frames <= 1 < num_total:
-            for file in filenames[1:]:
-                try:
-                    ds = pydicom.dcmread(file, force=force_read)
-                    if "TransferSyntaxUID" not in ds.file_meta:
-                        ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
-                    if "SpacingBetweenSlices" not in ds:
-                        ds.SpacingBetweenSlices = ds.SliceThickness if hasattr(ds, "SliceThickness") else 1
-                    modality = ds.Modality
-                    frames = ds.NumberOfFrames if "NumberOfFrames" in ds else 1
-                    # cannot mix modalities or multi frame images
-                    if (modality != first_modality) or (frames > 1) or not hasattr(ds, "PixelData"):
-                        raise pydicom.errors.InvalidDicomError
-                    if ds.file_meta.TransferSyntaxUID.is_compressed:
-                        ds.decompress()
-                    datasets.append(ds)
-                    num_ok += 1
-
-                except pydicom.errors.InvalidDicomError:
-                    filenames.remove(file)
-
-            # Try to sort based on instance number then SOPInstanceUID
-            sorted_method = "filenames"
-            try:
-                order = sorted(range(len(datasets)), key=lambda i: datasets[i].InstanceNumber)
-                datasets = [datasets[i] for i in order]
-                filenames = [filenames[i] for i in order]
-                sorted_method = "instance number"
-            except (TypeError, AttributeError):
-                try:
-                    order = sorted(range(len(datasets)), key=lambda i: datasets[i].SOPInstanceUID)
-                    datasets = [datasets[i] for i in order]
-                    filenames = [filenames[i] for i in order]
-                    sorted_method = "SOP instance UID"
-                except (TypeError, AttributeError):
-                    pass
-        self.imager = Imager(datasets, self.ui.action_Scale_LUT.isChecked())
-        self.filenames = filenames
-        num_bad = num_total - num_ok
+        # scan the headers and group the files into series, only the first series is read in full
+        self.force_read = force_read
+        self.series, self.num_rejected = scan_series(
+            filenames,
+            force_read,
+            max_workers=self.settings.value("PyDicom/Load threads", 0, type=int),
+            progress=self.load_progress,
+            catalog=self.catalog)
+        self.series_imagers = {}
+        self.ui.cbSeries.blockSignals(True)
+        self.ui.cbSeries.clear()
+        for i, series in enumerate(self.series):
+            self.ui.cbSeries.addItem(f"Series {i + 1}: {series[0].modality} ({len(series)} files)")
+            self.ui.cbSeries.setItemData(i, series[0].series_uid, Qt.ToolTipRole)
+        self.ui.cbSeries.blockSignals(False)
+        self.ui.action_Series.setVisible(len(self.series) > 1)
+        self.load_series(0)
+
+    def load_series(self, index: int):
+        # each series is read into its own imager the first time it is selected
+        if index not in self.series_imagers:
+            series = self.series[index] if index < len(self.series) else []
+            memory_map_mb = self.settings.value("PyDicom/Memory map above MB", 1024, type=int)
+            datasets, filenames, sorted_method = read_series(
+                series,
+                self.force_read,
+                max_workers=self.settings.value("PyDicom/Load threads", 0, type=int),
+                progress=self.load_progress,
+                defer_size=memory_map_mb * 2**20 if memory_map_mb > 0 else None)
+            imager = Imager(datasets,
+                            self.ui.action_Scale_LUT.isChecked(),
+                            lazy=self.settings.value("PyDicom/Lazy loading", True, type=bool),
+                            cache_size=self.settings.value("PyDicom/Slice cache", 32, type=int),
+                            memory_map_mb=memory_map_mb)
+            self.series_imagers[index] = (imager,
+                                          filenames,
+                                          sorted_method)
+        self.imager, self.filenames, sorted_method = self.series_imagers[index]
+        self.imager.rescale = self.ui.action_Scale_LUT.isChecked()
+        num_ok = len(self.imager.datasets)
+        num_bad = self.num_rejected
+        series_text = f" in series {index + 1} of {len(self.series)}" if len(self.series) > 1 else ""
         if num_bad == 0:
-            self.ui.statusbar.status_message(f"Opened {num_ok} DICOM file(s) sorted on {sorted_method}. Rejected {num_bad} bad files.")
+            self.ui.statusbar.status_message(f"Opened {num_ok} DICOM file(s){series_text} sorted on {sorted_method}. Rejected {num_bad} bad files.")
+        else:
+            self.ui.statusbar.status_warn(f"Opened {num_ok} DICOM file(s){series_text} sorted on {sorted_method}. Rejected {num_bad} bad files.")
+
+    def select_series(self, index: int):
+        if 0 <= index < len(self.series):
+            self.load_series(index)
+            self.show_series()
+
+    def show_series(self):
+        # does the file have a recognised image format?
+        if ((self.imager.datasets[0].Modality in supported_modalities)
+                and ("PixelData" in self.imager.datasets[0])):
+            self.tab_changed(0)
+            self.edit_pixel_data()
+            update_popups(self)
         else:
-            self.ui.statusbar.status_warn(f"Opened {num_ok} DICOM file(s) sorted on {sorted_method}. Rejected {num_bad} bad files.")
+            self.ui.tabWidget.setTabVisible(0, False)
+            self.ui.action_DICOM_tags.setChecked(True)
+            self.tab_changed(1)
+
+    def load_progress(self, stage: str, done: int, total: int):
+        self.ui.statusbar.status_message(f"{stage} file {done} of {total}")
+        QApplication.processEvents()
 
     def open_file(self):
         # remove any previous images
         del self.imager
         self.imager = None
+        self.series_imagers = {}
         self.ui.qlImage.clear()
         # is the filename a directory or archive
         if len(self.filenames) == 1:
@@ -317,6 +361,8 @@ class LinaQA(QMainWindow):
                 #                   if os.path.isfile(os.path.join(dir_path, file_name))]
                 self.filenames = [os.path.join(dir_path, file_name) for file_name in os.listdir(dir_path)
                                   if osp.splitext(file_name)[1] in [".dcm", ".DCM", ".ima", ".IMA", ".2"]]
+                if self.catalog is not None:
+                    self.catalog.prune(dir_path, self.filenames)
             # check if file is archive
             elif osp.splitext(self.filenames[0])[1] == ".zip":
                 self.zip_dir = TemporaryZipDirectory(self.filenames[0], delete=False)
@@ -328,16 +374,7 @@ class LinaQA(QMainWindow):
         force_open = self.settings.value("PyDicom/Force", False, type=bool)
         if pydicom.misc.is_dicom(self.filenames[0]) or force_open:
             self.open_image(self.filenames, force_open)
-            # does the file have a recognised image format?
-            if ((self.imager.datasets[0].Modality in supported_modalities)
-                    and hasattr(self.imager.datasets[0], "PixelData")):
-                self.tab_changed(0)
-                self.edit_pixel_data()
-                update_popups(self)
-            else:
-                self.ui.tabWidget.setTabVisible(0, False)
-                self.ui.action_DICOM_tags.setChecked(True)
-                self.tab_changed(1)
+            self.show_series()
         else:
             the_image = QPixmap(self.filenames[0])
             if the_image.isNull():
@@ -417,10 +454,19 @@ class LinaQA(QMainWindow):
             self.ui.statusbar.status_message(f"{i} images saved in " + dirpath)
 
     @staticmethod
-    def show_image(numpy_array, label: QLabel):
+    def display_size(label: QLabel) -> tuple[int, int] | None:
+        # size of the label in device pixels
+        ratio = label.devicePixelRatioF()
+        return (int(label.width() * ratio), int(label.height() * ratio)) if label.width() > 0 else None
+
+    @staticmethod
+    def show_image(imager: Imager, label: QLabel):
+        # render the current image at no more than the resolution of the label on screen
+        numpy_array = imager.get_current_image(LinaQA.display_size(label))
         if numpy_array is not None:
-            # create a QImage from Numpy array and display it in a label
-            qpimage = QImage(numpy_array, numpy_array.shape[1], numpy_array.shape[0], QImage.Format_ARGB32)
+            # create a QImage from the 8 bit Numpy array and display it in a label
+            qpimage = QImage(numpy_array, numpy_array.shape[1], numpy_array.shape[0], numpy_array.strides[0],
+                             QImage.Format_Grayscale8)
             label.setPixmap(QPixmap.fromImage(qpimage).
                             scaled(label.width(),
                             label.height(),
@@ -470,14 +516,20 @@ class LinaQA(QMainWindow):
         image_rect = self.ui.qlImage.rect()
         if ((tab_index == 0) and image_rect.contains(mouse_pos) and
            self.imager is not None and hasattr(self.imager, "values")):
-            self.imager.index += int(event.angleDelta().y()/120)
-            self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+            step = int(event.angleDelta().y()/120)
+            self.imager.index += step
+            self.show_image(self.imager, self.ui.qlImage)
+            self.imager.prefetch(step, self.settings.value("PyDicom/Prefetch slices", 4, type=int),
+                                 self.display_size(self.ui.qlImage))
             self.ui.statusbar.status_message(f"Current slice {self.imager.index}")
             event.accept()
         elif ((tab_index == 2) and self.ui.qlRef.rect().contains(mouse_pos) and
               self.ref_imager is not None and hasattr(self.ref_imager, "values")):
-            self.ref_imager.index += int(event.angleDelta().y()/120)
-            self.show_image(self.ref_imager.get_current_image(), self.ui.qlRef)
+            step = int(event.angleDelta().y()/120)
+            self.ref_imager.index += step
+            self.show_image(self.ref_imager, self.ui.qlRef)
+            self.ref_imager.prefetch(step, self.settings.value("PyDicom/Prefetch slices", 4, type=int),
+                                     self.display_size(self.ui.qlRef))
             self.ui.statusbar.status_message(f"Current slice {self.ref_imager.index}")
             event.accept()
 
@@ -504,7 +556,7 @@ class LinaQA(QMainWindow):
                 self.mouse_last_pos = mouse_pos
                 self.imager.window_width += delta.x()
                 self.imager.window_center += delta.y()
-                self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+                self.show_image(self.imager, self.ui.qlImage)
                 self.ui.statusbar.status_message(f"Window center {self.imager.window_center}, Window width {self.imager.window_width}")
                 event.accept()
             if ((tab_index == 2) and image_rect.contains(mouse_pos) and
@@ -513,7 +565,7 @@ class LinaQA(QMainWindow):
                 self.mouse_last_pos = mouse_pos
                 self.ref_imager.window_width += delta.x()
                 self.ref_imager.window_center += delta.y()
-                self.show_image(self.ref_imager.get_current_image(), self.ui.qlRef)
+                self.show_image(self.ref_imager, self.ui.qlRef)
                 self.ui.statusbar.status_message(f"Window center {self.ref_imager.window_center}, Window width {self.ref_imager.window_width}")
                 event.accept()
 
@@ -538,7 +590,7 @@ class LinaQA(QMainWindow):
 
     def resizeEvent(self, event):
         if self.imager is not None and hasattr(self.imager, "values"):
-            self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+            self.show_image(self.imager, self.ui.qlImage)
 
     def tab_changed(self, index):
         if index != 1:
@@ -553,14 +605,14 @@ class LinaQA(QMainWindow):
                         self.imager.datasets[self.imager.index].PixelData = (
                             self.imager.datasets[self.imager.index].pixel_array.tobytes())
                         self.imager.load_pixel_data(self.imager.datasets)
-                self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+                self.show_image(self.imager, self.ui.qlImage)
                 self.ui.tabWidget.setTabVisible(0, True)
                 self.ui.tabWidget.setCurrentIndex(0)
             elif index == 1:
                 self.ui.action_DICOM_tags.setChecked(True)
                 self.show_dicom_toolbar()
             elif (index == 2) and (self.ref_imager is not None):
-                self.show_image(self.ref_imager.get_current_image(), self.ui.qlRef)
+                self.show_image(self.ref_imager, self.ui.qlRef)
                 self.ui.tabWidget.setTabVisible(2, True)
                 self.ui.tabWidget.setCurrentIndex(2)
             elif (index == 3) and (self.imager is not None):
@@ -586,31 +638,110 @@ class LinaQA(QMainWindow):
 
     def show_results(self, test, filename=""):
         if filename == "":
-            if len(self.filenames) == 1:
-                filename = osp.splitext(self.filenames[0])[0] + ".pdf"
-            elif len(self.filenames) > 1:
-                filename = test._model + " Analysis.pdf" if hasattr(test, "_model") else "Analysis.pdf"
-                filename = osp.join(self.working_dir, filename)
+            filename = self.results_filename(test, self.filenames, self.working_dir)
         if osp.exists(filename):
             QApplication.restoreOverrideCursor()
             filename = QFileDialog.getSaveFileName(self, "File exists, save file as:", filename, "PDF files (*.pdf)")[0]
+        self.show_summary(analysisunit.summary(test))
         if len(filename) > 0:
-            notes = self.ui.pte_notes.toPlainText().split("\n") if self.ui.pte_notes.toPlainText() != "" else None
-            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-            QApplication.processEvents()
-            test.publish_pdf(filename,
-                             notes=notes,
-                             metadata=self.settings.value("General/Metadata"),
-                             logo=self.settings.value("General/Logo"))
-            QApplication.restoreOverrideCursor()
-            QApplication.processEvents()
-            if open_path(filename):
-                self.ui.statusbar.status_message("Results displayed in PDF")
-            else:
-                self.ui.statusbar.status_error("No reader to open document")
+            self.publish_report(AnalysisWorker(analysisunit.report,
+                                               test,
+                                               filename,
+                                               self.report_notes(),
+                                               self.settings.value("General/Metadata"),
+                                               self.settings.value("General/Logo")))
         else:
             self.ui.statusbar.status_warn("Results not saved.")
 
+    def show_summary(self, text: str):
+        if text != "":
+            self.ui.pte_results.setPlainText(text)
+            self.ui.tabWidget.setTabVisible(6, True)
+            self.ui.tabWidget.setCurrentIndex(6)
+
+    def report_notes(self) -> list | None:
+        return self.ui.pte_notes.toPlainText().split("\n") if self.ui.pte_notes.toPlainText() != "" else None
+
+    def publish_report(self, worker: AnalysisWorker):
+        # write the report in the background, the results summary has already been shown
+        worker.signals.progress.connect(self.ui.statusbar.status_message)
+        worker.signals.finished.connect(self.report_done)
+        worker.signals.error.connect(
+            lambda e: self.ui.statusbar.status_error(f"Could not write report. Reason: {repr(e)}"))
+        self.report_pool.start(worker)
+
+    def report_done(self, filename: str):
+        if open_path(filename):
+            self.ui.statusbar.status_message("Results displayed in PDF")
+        else:
+            self.ui.statusbar.status_error("No reader to open document")
+
+    @staticmethod
+    def results_filename(test, filenames: list, working_dir: str) -> str:
+        filename = ""
+        if len(filenames) == 1:
+            filename = osp.splitext(filenames[0])[0] + ".pdf"
+        elif len(filenames) > 1:
+            filename = test._model + " Analysis.pdf" if hasattr(test, "_model") else "Analysis.pdf"
+            filename = osp.join(working_dir, filename)
+        return filename
+
+    @staticmethod
+    def analysis_datasets(imager: Imager) -> list:
+        # the analysis gets its own copies so that it is not affected by anything done to the images while it runs,
+        # the pixel data is shared rather than copied
+        return [copy_dataset(ds) for ds in imager.datasets]
+
+    def run_analysis(self, worker: AnalysisWorker, on_finished=None, filename: str = "",
+                     error_text: str = "Could not analyze image(s)", nm: bool = False):
+        # run the analysis in the background, results and errors come back to the status bar on the GUI thread
+        if self.worker is not None:
+            self.ui.statusbar.status_warn("An analysis is already running. Wait for it to finish or cancel it.")
+            return
+        filenames = list(self.filenames)
+        working_dir = self.working_dir
+        if on_finished is None:
+            def on_finished(test):
+                self.show_results(test, filename if filename else self.results_filename(test, filenames, working_dir))
+        # clear the busy indicator first so that the results can report to the status bar
+        worker.signals.finished.connect(self.analysis_done)
+        worker.signals.error.connect(self.analysis_done)
+        worker.signals.cancelled.connect(self.analysis_done)
+        worker.signals.progress.connect(self.ui.statusbar.show_busy)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.error.connect(lambda e: self.analysis_error(e, error_text, nm))
+        worker.signals.cancelled.connect(lambda: self.ui.statusbar.status_warn("Analysis cancelled."))
+        self.result_cache.set_limit(self.settings.value("General/Result cache MB", 512, type=float))
+        worker.cache = self.result_cache
+        self.worker = worker
+        self.ui.statusbar.show_busy("Starting analysis")
+        self.thread_pool.start(worker)
+
+    def run_nm_test(self, test_class, args: tuple, params: dict = None, share_volume: bool = True):
+        # tests of the whole series use the volume the imager has already decoded rather than decoding it again
+        volume = self.imager.frames_volume() if share_volume else None
+        self.run_analysis(AnalysisWorker(analysisunit.nm_test, test_class, args, params or {}, volume), nm=True)
+
+    def analysis_done(self, *args):
+        self.worker = None
+        self.ui.statusbar.hide_busy()
+
+    def analysis_error(self, e: Exception, error_text: str, nm: bool):
+        if nm and isinstance(e, TypeError):
+            self.ui.statusbar.status_error("The file is not a nuclear medicine or PET image.")
+        else:
+            self.ui.statusbar.status_error(f"{error_text}. Reason: {repr(e)}")
+
+    def clear_result_cache(self):
+        self.result_cache.invalidate()
+        self.ui.statusbar.status_message("Results cache cleared. Analyses will be run afresh.")
+
+    def cancel_analysis(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.ui.statusbar.cancel_button.setEnabled(False)
+            self.ui.statusbar.status_message("Cancelling analysis. Waiting for the current stage to finish.")
+
     def on_cbcatphan_changed(self, index_value: str):
         cb_text = self.ui.cbCatPhan.currentText()
         self.ui.action_CatPhan.setToolTip(f"Analyse {cb_text} Phantom. Long or right click to change phantom.")
@@ -915,202 +1046,145 @@ class LinaQA(QMainWindow):
 # Radiotherapy analysis
 # ---------------------------------------------------------------------------------------------------------------------
     @check_valid_image
-    @show_wait_cursor
     def analyse_catphan(self):
-        try:
-            # see if we have a new version of pylinac that can create direct from the dataset
-            streams = DicomImageStack(self.imager.datasets)
-        except TypeError:
-            # if not fall back to stream
-            streams = datasets_to_stream(self.imager.datasets)
+        phantom = analysisunit.phantom_3d(self.ui.cbCatPhan.currentText())
         param_list = {}
-        if self.ui.cbCatPhan.currentText() == "QuartDVT":
-            cat = QuartDVT(streams)
-        elif self.ui.cbCatPhan.currentText() == "ACR CT":
-            cat = ACRCT(streams)
-        elif self.ui.cbCatPhan.currentText() == "ACR MRI":
-            cat = ACRMRILarge(streams)
-        else:
-            cat = getattr(ct, self.ui.cbCatPhan.currentText())(streams)
+        if phantom not in (QuartDVT, ACRCT, ACRMRILarge):
             param_list = {"hu_tolerance": int(self.settings.value("3D Phantoms/HU Tolerance")),
                           "thickness_tolerance": float(self.settings.value("3D Phantoms/Thickness Tolerance")),
                           "scaling_tolerance": float(self.settings.value("3D Phantoms/Scaling Tolerance"))}
-        if self.imager.invflag:
-            for im in cat.dicom_stack.images:
-                im.invert()
-        cat.analyze(**param_list)
-        self.show_results(cat)
+        self.run_analysis(AnalysisWorker(analysisunit.catphan,
+                                         phantom,
+                                         self.analysis_datasets(self.imager),
+                                         param_list,
+                                         self.imager.invflag))
 
-#    @check_valid_image
-    @show_wait_cursor
+    @check_valid_image
     def analyse_picket_fence(self):
-        stream = dataset_to_stream(self.imager.datasets[self.imager.index])
-        if self.settings.value("Picket Fence/Apply median filter", False, type=bool):
-            pf = picketfence.PicketFence(stream, mlc=self.ui.cbMLC.currentText(), filter=3)
-        else:
-            pf = picketfence.PicketFence(stream, mlc=self.ui.cbMLC.currentText())
+        self.run_analysis(AnalysisWorker(analysisunit.picket_fence,
+                                         copy_dataset(self.imager.datasets[self.imager.index]),
+                                         self.ui.cbMLC.currentText(),
+                                         *self.picket_fence_params()))
 
-        # get settings
+    @check_valid_image
+    def analyse_picket_fence_batch(self):
+        # every image opened, not just the series on display, each worker reads its own image
+        filenames = [h.filename for series in self.series for h in series if h.has_pixels]
+        self.run_analysis(AnalysisWorker(pfbatchunit.analyse_batch,
+                                         filenames,
+                                         self.ui.cbMLC.currentText(),
+                                         *self.picket_fence_params(),
+                                         self.settings.value("Picket Fence/Max workers", 0, type=int)),
+                          # named for the batch as the command line does, the leaf table CSV takes the same name
+                          filename=osp.join(self.working_dir, f"{pfbatchunit.PicketFenceBatch._model} Analysis.pdf"))
+
+    def picket_fence_params(self) -> tuple:
+        # median filter and analysis parameters from the settings
+        pf_filter = 3 if self.settings.value("Picket Fence/Apply median filter", False, type=bool) else None
         tolerance = self.settings.value("Picket Fence/Leaf Tolerance", 0.5, type=float)
         action_tolerance = self.settings.value("Picket Fence/Leaf Action", 0.25, type=float)
         num_pickets = self.settings.value("Picket Fence/Number of pickets", 0, type=int)
         picket_spacing = self.settings.value("Picket Fence/Picket Spacing", 0, type=int)
-        try:
-            pf.analyze(tolerance=tolerance,
-                       action_tolerance=None if action_tolerance == 0 else action_tolerance,
-                       num_pickets=None if num_pickets == 0 else num_pickets,
-                       picket_spacing=None if picket_spacing == 0 else picket_spacing,
-                       invert=self.imager.invflag)
-            self.show_results(pf)
-        except ValueError:
-            # if it throws an exception fall back to this as per issue #470
-            self.ui.statusbar.status_warn("Could not analyze picket fence as is. Trying fallback method.")
-            pf.analyze(tolerance=tolerance,
-                       action_tolerance=None if action_tolerance == 0 else action_tolerance,
-                       num_pickets=None if num_pickets == 0 else num_pickets,
-                       picket_spacing=None if picket_spacing == 0 else picket_spacing,
-                       invert=self.imager.invflag,
-                       required_prominence=0.1)
-            self.show_results(pf)
+        return pf_filter, {"tolerance": tolerance,
+                           "action_tolerance": None if action_tolerance == 0 else action_tolerance,
+                           "num_pickets": None if num_pickets == 0 else num_pickets,
+                           "picket_spacing": None if picket_spacing == 0 else picket_spacing,
+                           "invert": self.imager.invflag}
 
     @check_valid_image
-    @show_wait_cursor
     def analyse_winston_lutz(self):
-        streams = datasets_to_stream(self.imager.datasets)
-        wl = winston_lutz.WinstonLutz(streams)
-        if self.imager.invflag:
-            for im in wl.images:
-                im.invert()
-        wl.analyze(bb_size_mm=float(self.settings.value("Winston-Lutz/BB Size")),
-                   open_field=self.settings.value("Winston-Lutz/Open field", False, type=bool),
-                   low_density_bb=self.settings.value("Winston-Lutz/Low density BB", False, type=bool))
-        self.show_results(wl)
+        self.run_analysis(AnalysisWorker(
+            analysisunit.winston_lutz_test,
+            self.analysis_datasets(self.imager),
+            self.imager.invflag,
+            {"bb_size_mm": float(self.settings.value("Winston-Lutz/BB Size")),
+             "open_field": self.settings.value("Winston-Lutz/Open field", False, type=bool),
+             "low_density_bb": self.settings.value("Winston-Lutz/Low density BB", False, type=bool),
+             "max_workers": self.settings.value("Winston-Lutz/Max workers", 0, type=int)}))
 
     @check_valid_image
-    @show_wait_cursor
     def analyse_2d_phantoms(self):
-        stream = dataset_to_stream(self.imager.datasets[self.imager.index])
-        phantom_class = [obj for name, obj in inspect.getmembers(planar_imaging)
-                         if hasattr(obj, "common_name") and obj.common_name == self.ui.cbPhan2D.currentText()]
-        phan = phantom_class[0](stream)
-        phan.analyze(
-            low_contrast_threshold=float(self.settings.value("2D Phantoms/Low contrast threshold")),
-            high_contrast_threshold=float(self.settings.value("2D Phantoms/High contrast threshold")),
-            invert=self.imager.invflag,
-            angle_override=(None if self.ui.sbAngle.value() == 0
-                            else self.ui.sbAngle.value()),
-            center_override=(None if self.ui.sbCentreX.value() == 0 and self.ui.sbCentreY.value() == 0
-                             else (self.ui.sbCentreX.value(), self.ui.sbCentreY.value())),
-            size_override=(None if self.settings.value("2D Phantoms/Size override") == "0"
-                           else float(self.settings.value("2D Phantoms/Size override"))),
-            ssd=("auto" if self.settings.value("2D Phantoms/SSD") == "1000"
-                 else float(self.settings.value("2D Phantoms/SSD"))))
-        self.show_results(phan)
+        self.run_analysis(AnalysisWorker(
+            analysisunit.planar_phantom,
+            analysisunit.phantom_2d(self.ui.cbPhan2D.currentText()),
+            copy_dataset(self.imager.datasets[self.imager.index]),
+            {"low_contrast_threshold": float(self.settings.value("2D Phantoms/Low contrast threshold")),
+             "high_contrast_threshold": float(self.settings.value("2D Phantoms/High contrast threshold")),
+             "invert": self.imager.invflag,
+             "angle_override": (None if self.ui.sbAngle.value() == 0
+                                else self.ui.sbAngle.value()),
+             "center_override": (None if self.ui.sbCentreX.value() == 0 and self.ui.sbCentreY.value() == 0
+                                 else (self.ui.sbCentreX.value(), self.ui.sbCentreY.value())),
+             "size_override": (None if self.settings.value("2D Phantoms/Size override") == "0"
+                               else float(self.settings.value("2D Phantoms/Size override"))),
+             "ssd": ("auto" if self.settings.value("2D Phantoms/SSD") == "1000"
+                     else float(self.settings.value("2D Phantoms/SSD")))}))
 
     @check_valid_image
-    @show_wait_cursor
     def analyse_vmat(self):
-        stream = dataset_to_stream(self.imager.datasets[self.imager.index])
-        try:
-            ref_stream = dataset_to_stream(self.ref_imager.datasets[self.imager.index])
-            images = (stream, ref_stream)
-            if self.ui.cbVMAT.currentText() == "DRGS":
-                v = vmat.DRGS(image_paths=images)
-            elif self.ui.cbVMAT.currentText() == "DRMLC":
-                v = vmat.DRMLC(image_paths=images)
-            elif self.ui.cbVMAT.currentText() == "DRCS":
-                v = vmat.DRCS(image_paths=images)
-            v.analyze(tolerance=float(self.settings.value("VMAT/Tolerance")))
-            v.open_image.base_path = self.filenames[0]
-            v.dmlc_image.base_path = self.ref_filename
-            self.show_results(v)
-        except AttributeError:
+        if self.ref_imager is None:
             self.ui.statusbar.status_error("No reference image defined. Please open a reference image.")
+            return
+        self.run_analysis(AnalysisWorker(analysisunit.vmat_test,
+                                         self.ui.cbVMAT.currentText(),
+                                         copy_dataset(self.imager.datasets[self.imager.index]),
+                                         copy_dataset(self.ref_imager.datasets[self.imager.index]),
+                                         self.filenames[0],
+                                         self.ref_filename,
+                                         float(self.settings.value("VMAT/Tolerance"))))
 
-    @show_wait_cursor
     # we can't check if image is valid yet as we can have a jpeg image
     def analyse_star(self):
-        filename, ext = osp.splitext(self.filenames[0])
-        if len(self.filenames) == 1:
-            if ext == ".zip":
-                star = starshot.Starshot.from_zip(self.filenames[0],
-                                                  sid=float(self.settings.value("Star shot/SID")),
-                                                  dpi=float(self.settings.value("Star shot/DPI")))
-            else:
-                star = starshot.Starshot(self.filenames[0],
-                                         sid=float(self.settings.value("Star shot/SID")),
-                                         dpi=float(self.settings.value("Star shot/DPI")))
-        else:
-            star = starshot.Starshot.from_multiple_images(self.filenames,
-                                                          sid=float(self.settings.value("Star shot/SID")),
-                                                          dpi=float(self.settings.value("Star shot/DPI")))
-        try:
-            star.analyze(radius=float(self.settings.value("Star shot/Normalised analysis radius")),
-                         tolerance=float(self.settings.value("Star shot/Tolerance")),
-                         recursive=self.settings.value("Star shot/Recursive analysis", False, type=bool),
-                         invert=self.imager.invflag if self.imager is not None else None)
-            filename = filename + ".pdf"
-            self.show_results(star, filename)
-        except Exception as e:
-            self.ui.statusbar.status_error(f"Could not analyze image(s). Reason: {repr(e)}")
+        if len(self.filenames) == 0:
+            self.ui.statusbar.status_error("No image open. Please open an image!")
+            return
+        self.run_analysis(AnalysisWorker(
+            analysisunit.star_shot,
+            list(self.filenames),
+            float(self.settings.value("Star shot/SID")),
+            float(self.settings.value("Star shot/DPI")),
+            {"radius": float(self.settings.value("Star shot/Normalised analysis radius")),
+             "tolerance": float(self.settings.value("Star shot/Tolerance")),
+             "recursive": self.settings.value("Star shot/Recursive analysis", False, type=bool),
+             "invert": self.imager.invflag if self.imager is not None else None}),
+            filename=osp.splitext(self.filenames[0])[0] + ".pdf")
 
-    @show_wait_cursor
     def analyse_log(self):
-        try:
-            log = log_analyzer.load_log(self.filenames[0])
-            self.show_results(log)
-        except Exception as e:
-            self.ui.statusbar.status_error(f"Could not analyze log. Reason: {repr(e)}")
+        if len(self.filenames) == 0:
+            self.ui.statusbar.status_error("No log open. Please open a machine log!")
+            return
+        self.run_analysis(AnalysisWorker(analysisunit.machine_log, self.filenames[0]),
+                          error_text="Could not analyze log")
 
     @check_valid_image
-    @show_wait_cursor
     def analyse_gamma(self):
         if len(self.ref_filename) >> 0:
-            stream = dataset_to_stream(self.imager.datasets[self.imager.index])
-            try:
-                ref_stream = dataset_to_stream(self.ref_imager.datasets[self.imager.index])
-                eval_img = image.load(stream)
-                if self.imager.invflag:
-                    eval_img.invert()
-                ref_img = image.load(ref_stream)
-                eval_img.normalize()
-                ref_img.normalize()
-                gamma = eval_img.gamma(comparison_image=ref_img,
-                                       doseTA=self.settings.value("Gamma Analysis/Dose to agreement", 2.0, type=float),
-                                       distTA=self.settings.value("Gamma Analysis/Distance to agreement", 2.0, type=float),
-                                       threshold=self.settings.value("Gamma Analysis/Dose threshold", 0.05, type=float))
-                gamma_plot = plt.imshow(gamma)
-                gamma_plot.set_cmap("bwr")
-                plt.title(f"Gamma Analysis ({self.settings.value('Gamma Analysis/Dose to agreement')}"
-                          f"%/{self.settings.value('Gamma Analysis/Distance to agreement')}mm)")
-                plt.ylabel("Distance (pixels)")
-                plt.xlabel("Distance (pixels)")
-                plt.colorbar()
-                plt.clim(0, self.settings.value("Gamma Analysis/Gamma cap", 2.0, type=float))
-    #            plt.show()
-                filename = osp.splitext(self.filenames[0])[0] + ".pdf"
-                canvas = pdf.PylinacCanvas(filename,
-                                           page_title="Gamma analysis",
-                                           metadata=self.settings.value("General/Metadata"),
-                                           logo=self.settings.value("General/Logo"))
-                notes = self.ui.pte_notes.toPlainText() if self.ui.pte_notes.toPlainText() != "" else None,
-                if notes is not None:
-                    canvas.add_text(text="Notes:", location=(1, 4.5), font_size=14)
-                    canvas.add_text(text=notes, location=(1, 4))
-                img = io.BytesIO()
-                plt.savefig(img)
-                canvas.add_image(img, location=(1, 5), dimensions=(18, 18))
-                canvas.finish()
-                if open_path(filename):
-                    self.ui.statusbar.status_message("Results displayed in PDF")
-                else:
-                    self.ui.statusbar.status_error("No reader to open document")
-            except Exception as e:
-                self.ui.statusbar.status_error(f"Could not analyze image(s). Reason: {repr(e)}")
+            filename = osp.splitext(self.filenames[0])[0] + ".pdf"
+            self.run_analysis(AnalysisWorker(
+                analysisunit.gamma,
+                copy_dataset(self.imager.datasets[self.imager.index]),
+                copy_dataset(self.ref_imager.datasets[self.imager.index]),
+                self.imager.invflag,
+                self.settings.value("Gamma Analysis/Dose to agreement", 2.0, type=float),
+                self.settings.value("Gamma Analysis/Distance to agreement", 2.0, type=float),
+                self.settings.value("Gamma Analysis/Dose threshold", 0.05, type=float),
+                self.settings.value("Gamma Analysis/Gamma cap", 2.0, type=float),
+                self.settings.value("Gamma Analysis/Global dose", True, type=bool)),
+                on_finished=lambda result: self.show_gamma(result, filename))
         else:
             self.ui.tabWidget.setTabVisible(3, False)
             self.ui.statusbar.status_error("No reference image defined. Please open a reference image.")
 
+    def show_gamma(self, result, filename: str):
+        self.show_summary(result.summary())
+        self.publish_report(AnalysisWorker(
+            analysisunit.gamma_report,
+            result,
+            filename,
+            self.report_notes(),
+            self.settings.value("General/Metadata"),
+            self.settings.value("General/Logo")))
+
 # ---------------------------------------------------------------------------------------------------------------------
 # Reference image section
 # ---------------------------------------------------------------------------------------------------------------------
@@ -1136,7 +1210,7 @@ class LinaQA(QMainWindow):
         if self.ref_filename:
             if pydicom.misc.is_dicom(self.ref_filename):
                 self.open_ref_image(self.ref_filename)
-                # self.show_image(self.ref_imager.get_current_image(), self.ui.qlRef)
+                # self.show_image(self.ref_imager, self.ui.qlRef)
                 # self.ui.qlRef.show()
                 self.tab_changed(2)
             else:
@@ -1164,7 +1238,7 @@ class LinaQA(QMainWindow):
             self.imager.invflag = False
         else:
             self.imager.invflag = True
-        self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+        self.show_image(self.imager, self.ui.qlImage)
 
     @check_valid_image
     def scale_lut(self):
@@ -1174,19 +1248,19 @@ class LinaQA(QMainWindow):
     @check_valid_image
     def flip_left_right(self):
         self.imager.flip_lr()
-        self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+        self.show_image(self.imager, self.ui.qlImage)
         self.ui.statusbar.status_message(f"Image(s) have been flipped left-right")
 
     @check_valid_image
     def flip_up_down(self):
         self.imager.flip_ud()
-        self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+        self.show_image(self.imager, self.ui.qlImage)
         self.ui.statusbar.status_message(f"Image(s) have been flipped up-down")
 
     @check_valid_image
     def auto_window(self):
         self.imager.auto_window()
-        self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+        self.show_image(self.imager, self.ui.qlImage)
         self.ui.statusbar.status_message(f"Window center {self.imager.window_center:.1f}, Window width {self.imager.window_width:.1f}")
 
     @check_valid_image
@@ -1208,7 +1282,7 @@ class LinaQA(QMainWindow):
         # We must sum and rescale.
         num_images = self.imager.size[2]
         self.imager.sum_images()
-        self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+        self.show_image(self.imager, self.ui.qlImage)
         self.is_changed = True
         self.ui.statusbar.status_message(f"{num_images} images were summed. Image has been rescaled.")
 
@@ -1216,7 +1290,7 @@ class LinaQA(QMainWindow):
     def avg_image(self):
         num_images = self.imager.size[2]
         self.imager.avg_images()
-        self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+        self.show_image(self.imager, self.ui.qlImage)
         self.is_changed = True
         self.ui.statusbar.status_message(f"{num_images} images were averaged")
 
@@ -1224,7 +1298,7 @@ class LinaQA(QMainWindow):
     def scale_image(self):
         num_images = self.imager.size[2]
         self.imager.scale_images(self.ui.dsbScaleFactor.value())
-        self.show_image(self.imager.get_current_image(), self.ui.qlImage)
+        self.show_image(self.imager, self.ui.qlImage)
         self.is_changed = True
         self.ui.statusbar.status_message(f"{num_images} images were scaled")
 
@@ -1234,84 +1308,72 @@ class LinaQA(QMainWindow):
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def max_count_rate(self):
-        mcr = pylinac_subclasses.LinaQAMaxCountRate(self.imager.datasets)
-        mcr.analyze()
-        self.show_results(mcr)
+        self.run_nm_test(pylinac_subclasses.LinaQAMaxCountRate, (self.analysis_datasets(self.imager),))
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def simple_sensitivity(self):
-        phantom_image = self.imager.datasets[self.imager.index]
-        background_image = self.ref_imager.datasets[0] if self.ref_imager is not None else None
-        ss = pylinac_subclasses.LinaQASimpleSensitivity(phantom_image, background_image)
-        ss.analyze(
-            activity_mbq=float(self.ui.dsbSimpleSensActivity.value()),
-            nuclide=getattr(pylinac_subclasses.Nuclide,
-                            self.settings.value("Simple Sensitivity/Nuclide", "Tc99m", type=str)))
-        self.show_results(ss)
+        phantom_image = copy_dataset(self.imager.datasets[self.imager.index])
+        background_image = copy_dataset(self.ref_imager.datasets[0]) if self.ref_imager is not None else None
+        self.run_nm_test(pylinac_subclasses.LinaQASimpleSensitivity,
+                         (phantom_image, background_image),
+                         {"activity_mbq": float(self.ui.dsbSimpleSensActivity.value()),
+                          "nuclide": getattr(pylinac_subclasses.Nuclide,
+                                             self.settings.value("Simple Sensitivity/Nuclide", "Tc99m", type=str))},
+                         share_volume=False)
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def planar_uniformity(self):
-        pu = pylinac_subclasses.LinaQAPlanarUniformity(self.imager.datasets)
-        pu.analyze()
-        self.show_results(pu)
+        self.run_nm_test(pylinac_subclasses.LinaQAPlanarUniformity, (self.analysis_datasets(self.imager),))
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def spatial_resolution(self):
         # four bar test
         if self.ui.cbSpatialRes.currentText() == spatial_res_list[0]:
-            sr = pylinac_subclasses.LinaQAFourBarRes(self.imager.datasets)
-            sr.analyze(
-                separation_mm=self.settings.value("Spatial Resolution/Separation mm", 100, type=float),
-                roi_width_mm=self.settings.value("Spatial Resolution/ROI width mm", 10, type=float))
+            self.run_nm_test(
+                pylinac_subclasses.LinaQAFourBarRes,
+                (self.analysis_datasets(self.imager),),
+                {"separation_mm": self.settings.value("Spatial Resolution/Separation mm", 100, type=float),
+                 "roi_width_mm": self.settings.value("Spatial Resolution/ROI width mm", 10, type=float)})
         # quadrant test
         elif self.ui.cbSpatialRes.currentText() == spatial_res_list[1]:
-            sr = pylinac_subclasses.LinaQAQuadrantRes(self.imager.datasets)
             widths_str = self.settings.value("Spatial Resolution/Bar widths mm", "(4.23, 3.18, 2.54, 2.12)", type=str)
             widths = tuple(float(w.strip()) for w in widths_str.strip("()").split(","))
-            sr.analyze(
-                bar_widths=widths,
-                roi_diameter_mm=self.settings.value("Spatial Resolution/ROI diameter mm", 70.0, type=float),
-                distance_from_center_mm=self.settings.value("Spatial Resolution/Distance from center mm",
-                                                            130.0,
-                                                            type=float))
-        self.show_results(sr)
+            self.run_nm_test(
+                pylinac_subclasses.LinaQAQuadrantRes,
+                (self.analysis_datasets(self.imager),),
+                {"bar_widths": widths,
+                 "roi_diameter_mm": self.settings.value("Spatial Resolution/ROI diameter mm", 70.0, type=float),
+                 "distance_from_center_mm": self.settings.value("Spatial Resolution/Distance from center mm",
+                                                                130.0,
+                                                                type=float)})
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def tomographic_uniformity(self):
-        tu = pylinac_subclasses.LinaQATomoUniformity(self.imager.datasets, not self.imager.rescale)
-        tu.analyze(
-            first_frame=int(self.ui.sbFirstFrame.value()),
-            last_frame=int(self.ui.sbLastFrame.value()),
-            ufov_ratio=self.settings.value("Tomographic Uniformity/UFOV ratio", 0.80, type=float),
-            cfov_ratio=self.settings.value("Tomographic Uniformity/CFOV ratio", 0.75, type=float),
-            center_ratio=self.settings.value("Tomographic Uniformity/Center ratio", 0.4, type=float),
-            threshold=self.settings.value("Tomographic Uniformity/Threshold", 0.75, type=float),
-            window_size=self.settings.value("Tomographic Uniformity/Window size", 5, type=int))
-        self.show_results(tu)
+        self.run_nm_test(
+            pylinac_subclasses.LinaQATomoUniformity,
+            (self.analysis_datasets(self.imager), not self.imager.rescale),
+            {"first_frame": int(self.ui.sbFirstFrame.value()),
+             "last_frame": int(self.ui.sbLastFrame.value()),
+             "ufov_ratio": self.settings.value("Tomographic Uniformity/UFOV ratio", 0.80, type=float),
+             "cfov_ratio": self.settings.value("Tomographic Uniformity/CFOV ratio", 0.75, type=float),
+             "center_ratio": self.settings.value("Tomographic Uniformity/Center ratio", 0.4, type=float),
+             "threshold": self.settings.value("Tomographic Uniformity/Threshold", 0.75, type=float),
+             "window_size": self.settings.value("Tomographic Uniformity/Window size", 5, type=int)})
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def tomographic_resolution(self):
-        tr = pylinac_subclasses.LinaQATomoResolution(self.imager.datasets, not self.imager.rescale)
-        tr.analyze()
-        self.show_results(tr)
+        self.run_nm_test(pylinac_subclasses.LinaQATomoResolution,
+                         (self.analysis_datasets(self.imager), not self.imager.rescale))
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def tomographic_contrast(self):
-        tc = pylinac_subclasses.LinaQATomoContrast(self.imager.datasets)
         sphere_diam_str = self.settings.value("Tomographic Contrast/Sphere diameters mm",
                                               "(38, 31.8, 25.4, 19.1, 15.9, 12.7)",
                                               type=str)
@@ -1320,17 +1382,16 @@ class LinaQA(QMainWindow):
                                              "(-10, -70, -130, -190, 110, 50)",
                                              type=str)
         sphere_ang = tuple(float(s.strip()) for s in sphere_ang_str.strip("()").split(","))
-        tc.analyze(
-            sphere_diameters_mm=sphere_diam,
-            sphere_angles=sphere_ang,
-            ufov_ratio=self.settings.value("Tomographic Contrast/UFOV ratio", 0.8, type=float))
-        self.show_results(tc)
+        self.run_nm_test(
+            pylinac_subclasses.LinaQATomoContrast,
+            (self.analysis_datasets(self.imager),),
+            {"sphere_diameters_mm": sphere_diam,
+             "sphere_angles": sphere_ang,
+             "ufov_ratio": self.settings.value("Tomographic Contrast/UFOV ratio", 0.8, type=float)})
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def suv_uptake(self):
-        su = pylinac_subclasses.SUVUptake(self.imager.datasets)
         sphere_diam_str = self.settings.value("SUV Uptake/Sphere diameters mm",
                                               "(37.0, 28.0, 22.0, 17.0, 13.0, 10.0)",
                                               type=str)
@@ -1363,27 +1424,25 @@ class LinaQA(QMainWindow):
         backgnd_dose -= backgnd_res * math.exp(-0.693147181 * backgnd_res_decay_time / half_life)
         stock_dose -= stock_res * math.exp(-0.693147181 * stock_res_decay_time / half_life)
 
-        su.analyze(
-            sphere_diameters_mm=sphere_diam,
-            sphere_angles=sphere_ang,
-            background_vol=backgnd_vol,
-            background_dose=backgnd_dose,
-            background_time=backgnd_time,
-            sphere_vol=stock_vol,
-            sphere_dose=stock_dose,
-            sphere_time=stock_time,
-            measurement_time=scan_time,
-            use_50_vol=use_50_area
-        )
-        self.show_results(su)
+        self.run_nm_test(
+            pylinac_subclasses.SUVUptake,
+            (self.analysis_datasets(self.imager),),
+            {"sphere_diameters_mm": sphere_diam,
+             "sphere_angles": sphere_ang,
+             "background_vol": backgnd_vol,
+             "background_dose": backgnd_dose,
+             "background_time": backgnd_time,
+             "sphere_vol": stock_vol,
+             "sphere_dose": stock_dose,
+             "sphere_time": stock_time,
+             "measurement_time": scan_time,
+             "use_50_vol": use_50_area,
+             "max_workers": self.settings.value("SUV Uptake/Max workers", 1, type=int)})
 
     @check_valid_image
     @catch_nm_type_error
-    @show_wait_cursor
     def centre_of_rotation(self):
-        cor = pylinac_subclasses.LinaQACenterOfRotation(self.imager.datasets)
-        cor.analyze()
-        self.show_results(cor)
+        self.run_nm_test(pylinac_subclasses.LinaQACenterOfRotation, (self.analysis_datasets(self.imager),))
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,247 @@
+"""
+======================
+Analyses run by LinaQA
+======================
+
+Each analysis is a generator that yields a progress message before each stage and returns the analysed pylinac
+object. They take plain parameters gathered on the GUI thread so that they can run in an AnalysisWorker while the user
+carries on browsing images. The reports are published the same way once the results have been shown.
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import io
+import os.path as osp
+import inspect
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from pylinac import (
+    image,
+    ct,
+    picketfence,
+    planar_imaging,
+    vmat,
+    starshot,
+    log_analyzer,
+    QuartDVT,
+    ACRCT,
+    ACRMRILarge)
+from pylinac.core import pdf
+
+from misc_utils import dataset_to_stream, datasets_to_stream, dataset_to_image
+from gammaunit import GammaResult, gamma_analysis
+from pylinac_subclasses import LinaQAWinstonLutz
+
+
+def phantom_3d(name: str):
+    # pylinac class for a phantom in phantom3D_list
+    if name == "QuartDVT":
+        return QuartDVT
+    elif name == "ACR CT":
+        return ACRCT
+    elif name == "ACR MRI":
+        return ACRMRILarge
+    else:
+        return getattr(ct, name)
+
+
+def phantom_2d(name: str):
+    # pylinac class for a phantom in phantom2D_list
+    return [obj for _, obj in inspect.getmembers(planar_imaging)
+            if hasattr(obj, "common_name") and obj.common_name == name][0]
+
+
+def catphan(phantom, datasets: list, params: dict, invert: bool):
+    """
+    CatPhan and other 3D phantoms
+    :param
+    phantom: pylinac phantom class
+    datasets: list of datasets in the series
+    params: keyword parameters for analyze
+    invert: invert the images before analysis
+    :return: analysed phantom
+    """
+    yield "Loading images"
+    try:
+        # pylinac_subclasses lets pylinac create the images direct from the datasets
+        cat = phantom(datasets)
+    except (TypeError, AttributeError):
+        # if not fall back to stream
+        cat = phantom(datasets_to_stream(datasets))
+    if invert:
+        for im in cat.dicom_stack.images:
+            im.invert()
+    yield "Analysing phantom"
+    cat.analyze(**params)
+    return cat
+
+
+def picket_fence(ds, mlc: str, pf_filter, params: dict):
+    yield "Loading image"
+    try:
+        pf = picketfence.PicketFence(ds, mlc=mlc, filter=pf_filter)
+    except (TypeError, AttributeError):
+        pf = picketfence.PicketFence(dataset_to_stream(ds), mlc=mlc, filter=pf_filter)
+    yield "Analysing picket fence"
+    try:
+        pf.analyze(**params)
+    except ValueError:
+        # if it throws an exception fall back to this as per issue #470
+        yield "Could not analyze picket fence as is. Trying fallback method."
+        pf.analyze(**params, required_prominence=0.1)
+    return pf
+
+
+def winston_lutz_test(datasets: list, invert: bool, params: dict):
+    yield "Loading images"
+    try:
+        wl = LinaQAWinstonLutz(datasets)
+    except (TypeError, AttributeError):
+        wl = LinaQAWinstonLutz(datasets_to_stream(datasets))
+    if invert:
+        for im in wl.images:
+            im.invert()
+    yield "Analysing Winston-Lutz images"
+    wl.analyze(**params)
+    return wl
+
+
+def planar_phantom(phantom_class, ds, params: dict):
+    yield "Loading image"
+    phan = phantom_class(dataset_to_image(ds))
+    yield "Analysing phantom"
+    phan.analyze(**params)
+    return phan
+
+
+def vmat_test(vmat_type: str, ds, ref_ds, filename: str, ref_filename: str, tolerance: float):
+    yield "Loading images"
+    images = (dataset_to_image(ds), dataset_to_image(ref_ds))
+    v = getattr(vmat, vmat_type)(image_paths=images)
+    yield "Analysing VMAT images"
+    v.analyze(tolerance=tolerance)
+    v.open_image.base_path = filename
+    v.dmlc_image.base_path = ref_filename
+    return v
+
+
+def star_shot(filenames: list, sid: float, dpi: float, params: dict):
+    yield "Loading images"
+    if len(filenames) == 1:
+        if osp.splitext(filenames[0])[1] == ".zip":
+            star = starshot.Starshot.from_zip(filenames[0], sid=sid, dpi=dpi)
+        else:
+            star = starshot.Starshot(filenames[0], sid=sid, dpi=dpi)
+    else:
+        star = starshot.Starshot.from_multiple_images(filenames, sid=sid, dpi=dpi)
+    yield "Analysing star shot"
+    star.analyze(**params)
+    return star
+
+
+def machine_log(filename: str):
+    yield "Loading log"
+    return log_analyzer.load_log(filename)
+
+
+def gamma(ds, ref_ds, invert: bool, dose_ta: float, dist_ta: float, threshold: float, gamma_cap: float,
+          global_dose: bool):
+    """
+    Gamma comparison of an image against the reference image. The map is plotted by gamma_report.
+    :return: GammaResult
+    """
+    yield "Loading images"
+    eval_img = image.load(dataset_to_image(ds))
+    if invert:
+        eval_img.invert()
+    ref_img = image.load(dataset_to_image(ref_ds))
+    if abs(eval_img.dpmm - ref_img.dpmm) > 0.01:
+        raise ValueError(f"The image resolutions do not match: {eval_img.dpmm:.2f} vs. {ref_img.dpmm:.2f} pixels/mm")
+    eval_img.normalize()
+    ref_img.normalize()
+    yield "Calculating gamma"
+    return gamma_analysis(eval_img.array, ref_img.array, 1 / eval_img.dpmm, dose_ta, dist_ta, threshold, gamma_cap,
+                          global_dose)
+
+
+def nm_test(test_class, args: tuple, params: dict, volume: np.ndarray | None = None):
+    """
+    Nuclear medicine tests. These raise TypeError if the images are not NM or PET.
+    :param
+    test_class: LinaQA nuclear medicine test class from pylinac_subclasses
+    args: positional arguments for the test class
+    params: keyword parameters for analyze
+    volume: pixel data already decoded from the datasets, frames first, which the test uses instead of decoding them
+    :return: analysed test
+    """
+    yield "Loading images"
+    test = test_class(*args) if volume is None else test_class(*args, volume=volume)
+    yield f"Running {getattr(test, '_model', 'analysis')}"
+    test.analyze(**params)
+    return test
+
+
+def summary(test) -> str:
+    # plain text results of an analysed test for display while the report is written
+    try:
+        text = test.results()
+    except AttributeError:
+        # not every analysis has text results, e.g. gamma
+        return ""
+    return "\n".join(text) if isinstance(text, (list, tuple)) else str(text)
+
+
+def report(test, filename: str, notes: list | None, metadata, logo):
+    """
+    Publish the PDF report of an analysed test. This is run on the report thread with the Agg backend so that drawing
+    the figures does not hold up the GUI.
+    :return: filename of the report
+    """
+    yield f"Writing report {osp.basename(filename)}"
+    test.publish_pdf(filename, notes=notes, metadata=metadata, logo=logo)
+    return filename
+
+
+def gamma_report(result: GammaResult, filename: str, notes: list | None, metadata, logo):
+    """
+    Plot a gamma map and its histogram and publish them as a PDF report.
+    :return: filename of the report
+    """
+    yield f"Writing report {osp.basename(filename)}"
+    canvas = pdf.PylinacCanvas(filename, page_title="Gamma analysis", metadata=metadata, logo=logo)
+    fig = plt.figure()
+    try:
+        gamma_plot = plt.imshow(result.gamma)
+        gamma_plot.set_cmap("bwr")
+        plt.title(f"Gamma Analysis ({result.dose_ta}%/{result.dist_ta}mm)")
+        plt.ylabel("Distance (pixels)")
+        plt.xlabel("Distance (pixels)")
+        plt.colorbar()
+        plt.clim(0, result.gamma_cap)
+        if notes is not None:
+            canvas.add_text(text="Notes:", location=(1, 4.5), font_size=14)
+            canvas.add_text(text=notes, location=(1, 4))
+        img = io.BytesIO()
+        fig.savefig(img)
+        canvas.add_image(img, location=(1, 5), dimensions=(18, 18))
+        canvas.add_new_page()
+        fig.clear()
+        ax = fig.add_subplot()
+        widths = np.diff(result.bin_edges)
+        ax.bar(result.bin_edges[:-1], 100 * result.histogram / max(result.evaluated, 1), width=widths, align="edge",
+               color=["tab:blue" if edge < 1 else "tab:red" for edge in result.bin_edges[:-1]], edgecolor="black")
+        ax.axvline(1, color="black", linestyle="--")
+        ax.set_title(f"Gamma Histogram, pass rate {result.pass_rate:.2f}%")
+        ax.set_xlabel("Gamma")
+        ax.set_ylabel("Pixels (%)")
+        img = io.BytesIO()
+        fig.savefig(img)
+        canvas.add_text(text=result.summary().split("\n"), location=(1, 25.5))
+        canvas.add_image(img, location=(1, 1), dimensions=(18, 12))
+        canvas.finish()
+    finally:
+        plt.close(fig)
+    return filename
@@ -0,0 +1,403 @@
+"""
+==================================
+Headless batch analysis for LinaQA
+==================================
+
+Runs a LinaQA analysis over many series without opening a window. The analysis parameters are read from the same
+settings the GUI uses, so set them up in LinaQA first. Each series is analysed in its own process and produces a PDF
+report and a JSON file of results. A summary of the run is written to batch_results.json.
+Usage: python batchunit.py catphan /path/to/CT [/path/to/more] [-o /path/to/reports]
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import os
+import os.path as osp
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+from PyQt5.QtCore import QSettings, QTime
+
+from settingsunit import set_default_settings
+from loaderunit import scan_series, read_series
+import analysisunit
+import pylinac_subclasses
+from pylinac import QuartDVT, ACRCT, ACRMRILarge
+
+organisation = "YenzakahleMPI"
+application = "LinaQA"
+
+# settings for the analyses in each worker process
+_settings = None
+
+
+def open_settings(settings_file: str | None = None) -> QSettings:
+    """
+    Open the LinaQA settings, or an ini file with the same keys, and fill in any missing defaults.
+    :param
+    settings_file: optional ini file, e.g. to keep the settings for each linac separate
+    :return: QSettings
+    """
+    if settings_file:
+        settings = QSettings(settings_file, QSettings.IniFormat)
+    else:
+        settings = QSettings(organisation, application)
+    set_default_settings(settings)
+    settings.sync()
+    return settings
+
+
+def setting_tuple(settings: QSettings, key: str, default: str) -> tuple:
+    # tuple settings are stored as strings, e.g. "(4.23, 3.18, 2.54, 2.12)"
+    return tuple(float(s.strip()) for s in settings.value(key, default, type=str).strip("()").split(","))
+
+
+def setting_none(settings: QSettings, key: str, default, value_type=float):
+    # zero means the parameter is not set
+    value = settings.value(key, default, type=value_type)
+    return None if value == 0 else value
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Analyses. Each takes the settings, datasets and filenames of a series and returns the analysisunit generator and
+# its arguments. Selections made on the toolbars in the GUI are taken from their defaults in the settings.
+# ---------------------------------------------------------------------------------------------------------------------
+def catphan_job(settings, datasets, filenames):
+    phantom = analysisunit.phantom_3d(settings.value("3D Phantoms/3D Type", "CatPhan604", type=str))
+    param_list = {}
+    if phantom not in (QuartDVT, ACRCT, ACRMRILarge):
+        param_list = {"hu_tolerance": int(settings.value("3D Phantoms/HU Tolerance")),
+                      "thickness_tolerance": float(settings.value("3D Phantoms/Thickness Tolerance")),
+                      "scaling_tolerance": float(settings.value("3D Phantoms/Scaling Tolerance"))}
+    return analysisunit.catphan, (phantom, datasets, param_list, False)
+
+
+def picket_fence_job(settings, datasets, filenames):
+    pf_filter = 3 if settings.value("Picket Fence/Apply median filter", False, type=bool) else None
+    return analysisunit.picket_fence, (
+        datasets[0],
+        settings.value("Picket Fence/MLC Type", "HD Millennium", type=str),
+        pf_filter,
+        {"tolerance": settings.value("Picket Fence/Leaf Tolerance", 0.5, type=float),
+         "action_tolerance": setting_none(settings, "Picket Fence/Leaf Action", 0.25),
+         "num_pickets": setting_none(settings, "Picket Fence/Number of pickets", 0, int),
+         "picket_spacing": setting_none(settings, "Picket Fence/Picket Spacing", 0, int),
+         "invert": False})
+
+
+def winston_lutz_job(settings, datasets, filenames):
+    return analysisunit.winston_lutz_test, (
+        datasets,
+        False,
+        {"bb_size_mm": float(settings.value("Winston-Lutz/BB Size")),
+         "open_field": settings.value("Winston-Lutz/Open field", False, type=bool),
+         "low_density_bb": settings.value("Winston-Lutz/Low density BB", False, type=bool),
+         # the batch already runs one analysis per process so the images are analysed one after another
+         "max_workers": 1})
+
+
+def phantom_2d_job(settings, datasets, filenames):
+    center = settings.value("2D Phantoms/Center override")
+    return analysisunit.planar_phantom, (
+        analysisunit.phantom_2d(settings.value("2D Phantoms/2D Type", "Leeds", type=str)),
+        datasets[0],
+        {"low_contrast_threshold": float(settings.value("2D Phantoms/Low contrast threshold")),
+         "high_contrast_threshold": float(settings.value("2D Phantoms/High contrast threshold")),
+         "invert": False,
+         "angle_override": setting_none(settings, "2D Phantoms/Angle override", 0),
+         "center_override": (None if center is None or (center.x() == 0 and center.y() == 0)
+                             else (center.x(), center.y())),
+         "size_override": setting_none(settings, "2D Phantoms/Size override", 0),
+         "ssd": ("auto" if settings.value("2D Phantoms/SSD") == "1000"
+                 else float(settings.value("2D Phantoms/SSD")))})
+
+
+def nm_job(test_class, args, params):
+    return analysisunit.nm_test, (test_class, args, params)
+
+
+def simple_sensitivity_job(settings, datasets, filenames):
+    return nm_job(pylinac_subclasses.LinaQASimpleSensitivity,
+                  (datasets[0], None),
+                  {"activity_mbq": settings.value("Simple Sensitivity/Activity MBq", 40.0, type=float),
+                   "nuclide": getattr(pylinac_subclasses.Nuclide,
+                                      settings.value("Simple Sensitivity/Nuclide", "Tc99m", type=str))})
+
+
+def spatial_resolution_job(settings, datasets, filenames):
+    if settings.value("Spatial Resolution/Resolution test", "Four Bar", type=str) == "Quadrant":
+        return nm_job(pylinac_subclasses.LinaQAQuadrantRes,
+                      (datasets,),
+                      {"bar_widths": setting_tuple(settings, "Spatial Resolution/Bar widths mm",
+                                                   "(4.23, 3.18, 2.54, 2.12)"),
+                       "roi_diameter_mm": settings.value("Spatial Resolution/ROI diameter mm", 70.0, type=float),
+                       "distance_from_center_mm": settings.value("Spatial Resolution/Distance from center mm",
+                                                                 130.0,
+                                                                 type=float)})
+    return nm_job(pylinac_subclasses.LinaQAFourBarRes,
+                  (datasets,),
+                  {"separation_mm": settings.value("Spatial Resolution/Separation mm", 100, type=float),
+                   "roi_width_mm": settings.value("Spatial Resolution/ROI width mm", 10, type=float)})
+
+
+def tomographic_uniformity_job(settings, datasets, filenames):
+    return nm_job(pylinac_subclasses.LinaQATomoUniformity,
+                  (datasets, not settings.value("PyDicom/Use rescale", False, type=bool)),
+                  {"first_frame": settings.value("Tomographic Uniformity/First frame", 0, type=int),
+                   "last_frame": settings.value("Tomographic Uniformity/Last frame", -1, type=int),
+                   "ufov_ratio": settings.value("Tomographic Uniformity/UFOV ratio", 0.80, type=float),
+                   "cfov_ratio": settings.value("Tomographic Uniformity/CFOV ratio", 0.75, type=float),
+                   "center_ratio": settings.value("Tomographic Uniformity/Center ratio", 0.4, type=float),
+                   "threshold": settings.value("Tomographic Uniformity/Threshold", 0.75, type=float),
+                   "window_size": settings.value("Tomographic Uniformity/Window size", 5, type=int)})
+
+
+def tomographic_resolution_job(settings, datasets, filenames):
+    return nm_job(pylinac_subclasses.LinaQATomoResolution,
+                  (datasets, not settings.value("PyDicom/Use rescale", False, type=bool)),
+                  {})
+
+
+def tomographic_contrast_job(settings, datasets, filenames):
+    return nm_job(pylinac_subclasses.LinaQATomoContrast,
+                  (datasets,),
+                  {"sphere_diameters_mm": setting_tuple(settings, "Tomographic Contrast/Sphere diameters mm",
+                                                        "(38, 31.8, 25.4, 19.1, 15.9, 12.7)"),
+                   "sphere_angles": setting_tuple(settings, "Tomographic Contrast/Sphere angles",
+                                                  "(-10, -70, -130, -190, 110, 50)"),
+                   "ufov_ratio": settings.value("Tomographic Contrast/UFOV ratio", 0.8, type=float)})
+
+
+def suv_uptake_job(settings, datasets, filenames):
+    # the activities and times come from the settings, or the DICOM header as in the SUV uptake popup.
+    # Residual activities cannot be entered in batch mode and are taken as zero.
+    ds = datasets[0]
+    seq = ds[0x0054, 0x0016][0]                 # Radiopharmaceutical Information Sequence
+    backgnd_vol = settings.value("SUV Uptake/Background vol", 0, type=int)
+    if backgnd_vol == 0:
+        backgnd_vol = int(ds[0x0010, 0x1030].value * 1000)
+    backgnd_dose = settings.value("SUV Uptake/Background dose", 0, type=float)
+    if backgnd_dose == 0:
+        backgnd_dose = int(seq[0x0018, 0x1074].value) / 1000000
+    stock_dose = settings.value("SUV Uptake/Stock dose", 0, type=float)
+    if stock_dose == 0:
+        stock_dose = backgnd_dose
+    dose_time = QTime.fromString(seq[0x0018, 0x1072].value.split(".")[0], "HHmmss")
+    scan_time = QTime.fromString(ds[0x0008, 0x0031].value.split(".")[0], "HHmmss")
+    return nm_job(pylinac_subclasses.SUVUptake,
+                  (datasets,),
+                  {"sphere_diameters_mm": setting_tuple(settings, "SUV Uptake/Sphere diameters mm",
+                                                        "(37.0, 28.0, 22.0, 17.0, 13.0, 10.0)"),
+                   "sphere_angles": setting_tuple(settings, "SUV Uptake/Sphere angles",
+                                                  "(120, 60, 0, -60, -120, -180)"),
+                   "background_vol": backgnd_vol,
+                   "background_dose": backgnd_dose * 1000000,        # convert to Becquerel
+                   "background_time": dose_time,
+                   "sphere_vol": settings.value("SUV Uptake/Stock vol", 0, type=int),
+                   "sphere_dose": stock_dose * 1000000,              # convert to Becquerel
+                   "sphere_time": dose_time,
+                   "measurement_time": scan_time,
+                   "use_50_vol": settings.value("SUV Uptake/Mean area", "Physical vol", type=str) == "50% isodose",
+                   # the batch already runs one analysis per process so the spheres are searched for one after another
+                   "max_workers": 1})
+
+
+# analysis name: (job, one job per image rather than per series)
+analyses = {
+    "catphan": (catphan_job, False),
+    "picket-fence": (picket_fence_job, True),
+    "winston-lutz": (winston_lutz_job, False),
+    "2d-phantom": (phantom_2d_job, True),
+    "max-count-rate": (lambda s, d, f: nm_job(pylinac_subclasses.LinaQAMaxCountRate, (d,), {}), False),
+    "simple-sensitivity": (simple_sensitivity_job, True),
+    "planar-uniformity": (lambda s, d, f: nm_job(pylinac_subclasses.LinaQAPlanarUniformity, (d,), {}), False),
+    "spatial-resolution": (spatial_resolution_job, False),
+    "tomographic-uniformity": (tomographic_uniformity_job, False),
+    "tomographic-resolution": (tomographic_resolution_job, False),
+    "tomographic-contrast": (tomographic_contrast_job, False),
+    "suv-uptake": (suv_uptake_job, False),
+    "centre-of-rotation": (lambda s, d, f: nm_job(pylinac_subclasses.LinaQACenterOfRotation, (d,), {}), False),
+}
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+# Running the batch
+# ---------------------------------------------------------------------------------------------------------------------
+def find_files(paths: list[str]) -> list[str]:
+    # expand directories recursively
+    filenames = []
+    for path in paths:
+        if osp.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                filenames.extend(osp.join(root, f) for f in sorted(files))
+        elif osp.isfile(path):
+            filenames.append(path)
+    return filenames
+
+
+def make_jobs(analysis: str, paths: list[str], force_read: bool = False, max_workers: int = 0) -> list[list]:
+    """
+    Group the input files into the series to analyse.
+    :param
+    analysis: name of the analysis, a key of analyses
+    paths: files and directories to analyse
+    :return: list of series, each a list of DicomHeader
+    """
+    groups, _ = scan_series(find_files(paths), force_read, max_workers)
+    if analyses[analysis][1]:
+        return [[h] for series in groups for h in series if h.has_pixels]
+    return [series for series in groups if any(h.has_pixels for h in series)]
+
+
+def init_worker(settings_file: str | None):
+    global _settings
+    matplotlib.use("Agg")
+    _settings = open_settings(settings_file)
+
+
+def json_default(value):
+    # numpy values and anything else json does not know about
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def results_dict(test) -> dict:
+    if hasattr(test, "results_data"):
+        try:
+            return test.results_data(as_dict=True)
+        except (NotImplementedError, TypeError):
+            # no results model or no dictionary form, the text results are used instead
+            pass
+    return {"summary": test.results()}
+
+
+def report_name(test, filenames: list[str], output_dir: str | None, index: int) -> str:
+    # same names as the GUI uses, numbered for multi file series so that reports do not overwrite each other. If a
+    # report of that name already exists a number is added. The json file is created here to claim the name, so that
+    # jobs running at the same time cannot both take it.
+    if len(filenames) == 1:
+        name = osp.splitext(osp.basename(filenames[0]))[0]
+    else:
+        name = f"{getattr(test, '_model', type(test).__name__)} Analysis {index + 1}"
+    base = osp.join(output_dir if output_dir else osp.dirname(filenames[0]), name)
+    path = base
+    copy = 1
+    while True:
+        if not osp.exists(path + ".pdf"):
+            try:
+                with open(path + ".json", "x"):
+                    return path
+            except FileExistsError:
+                pass
+        copy += 1
+        path = f"{base} ({copy})"
+
+
+def run_job(analysis: str, series: list, index: int, output_dir: str | None, notes: str | None,
+            force_read: bool = False) -> dict:
+    """
+    Analyse one series and publish its results. Runs in a worker process.
+    :return: dictionary describing the outcome for batch_results.json
+    """
+    start = time.perf_counter()
+    record = {"analysis": analysis, "files": [h.filename for h in series], "status": "error"}
+    name = None
+    try:
+        datasets, filenames, _ = read_series(series, force_read, max_workers=1)
+        record["files"] = filenames
+        function, args = analyses[analysis][0](_settings, datasets, filenames)
+        stages = function(*args)
+        try:
+            while True:
+                next(stages)
+        except StopIteration as result:
+            test = result.value
+        name = report_name(test, filenames, output_dir, index)
+        test.publish_pdf(name + ".pdf",
+                         notes=notes.split("\n") if notes else None,
+                         metadata=_settings.value("General/Metadata"),
+                         logo=_settings.value("General/Logo"))
+        with open(name + ".json", "w") as f:
+            json.dump(results_dict(test), f, indent=2, default=json_default)
+        record.update({"status": "ok", "pdf": name + ".pdf", "json": name + ".json"})
+    except Exception as e:
+        record["error"] = repr(e)
+        if name is not None:
+            # give up the name claimed for the report
+            for extension in (".pdf", ".json"):
+                if osp.exists(name + extension):
+                    os.remove(name + extension)
+    record["seconds"] = round(time.perf_counter() - start, 2)
+    return record
+
+
+def run_batch(analysis: str, paths: list[str], output_dir: str | None = None, workers: int = 0,
+              notes: str | None = None, settings_file: str | None = None, progress=None) -> list[dict]:
+    """
+    Run an analysis over all the series found in paths on a process pool.
+    :param
+    analysis: name of the analysis, a key of analyses
+    paths: files and directories to analyse
+    output_dir: directory for the reports, by default next to the images
+    workers: number of processes, 0 for one per core
+    notes: notes to add to each report
+    settings_file: optional ini file to use instead of the LinaQA settings
+    progress: optional callable(done, total, record) called as each series completes
+    :return: list of records, one per series
+    """
+    settings = open_settings(settings_file)
+    force_read = settings.value("PyDicom/Force", False, type=bool)
+    jobs = make_jobs(analysis, paths, force_read, settings.value("PyDicom/Load threads", 0, type=int))
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    records = []
+    with ProcessPoolExecutor(max_workers=workers if workers > 0 else None,
+                             initializer=init_worker,
+                             initargs=(settings_file,)) as pool:
+        futures = [pool.submit(run_job, analysis, series, i, output_dir, notes, force_read)
+                   for i, series in enumerate(jobs)]
+        for future in as_completed(futures):
+            records.append(future.result())
+            if progress is not None:
+                progress(len(records), len(futures), records[-1])
+    records.sort(key=lambda r: r["files"])
+    return records
+
+
+def print_progress(done: int, total: int, record: dict):
+    outcome = record.get("pdf", record.get("error"))
+    print(f"[{done}/{total}] {record['status']} {record['seconds']}s {record['files'][0]}: {outcome}", flush=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a LinaQA analysis over many series without the GUI.")
+    parser.add_argument("analysis", choices=list(analyses), help="analysis to run")
+    parser.add_argument("paths", nargs="+", help="DICOM files or directories, directories are searched recursively")
+    parser.add_argument("-o", "--output", help="directory for the reports, default is next to the images")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="number of processes, default one per core")
+    parser.add_argument("-n", "--notes", help="notes to add to each report")
+    parser.add_argument("-s", "--settings", help="ini file to use instead of the LinaQA settings")
+    args = parser.parse_args(argv)
+
+    matplotlib.use("Agg")
+    start = time.perf_counter()
+    records = run_batch(args.analysis, args.paths, args.output, args.workers, args.notes, args.settings,
+                        print_progress)
+    summary = osp.join(args.output if args.output else os.getcwd(), "batch_results.json")
+    with open(summary, "w") as f:
+        json.dump(records, f, indent=2)
+    failed = sum(r["status"] != "ok" for r in records)
+    print(f"Analysed {len(records)} series in {time.perf_counter() - start:.1f}s, {failed} failed. "
+          f"Summary in {summary}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
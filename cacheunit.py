@@ -0,0 +1,158 @@
+"""
+======================
+Analysis results cache
+======================
+
+Keeps analysed pylinac objects in memory keyed on the content of the images and the analysis parameters, so that
+repeating an analysis on the same images with the same settings, e.g. after changing the notes, only republishes the
+report. The least recently used results are dropped when the cache is full.
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from pydicom import Dataset
+from pydicom.dataelem import RawDataElement
+
+from loaderunit import raw_element
+
+
+def dataset_digest(ds: Dataset, h):
+    """
+    Add the content of a dataset to a hash. The elements are hashed as stored so that none are converted or decoded,
+    and elements left in the file by a deferred read, e.g. memory mapped pixel data, are hashed by the file, its
+    modification time and their position in it rather than read.
+    :param
+    ds: dataset
+    h: hashlib hash to update
+    """
+    for tag in sorted(ds.keys()):
+        elem = raw_element(ds, tag)
+        h.update(str(elem.tag).encode())
+        if isinstance(elem, RawDataElement):
+            if elem.value is None and elem.length:
+                modified = os.stat(ds.filename).st_mtime_ns if isinstance(ds.filename, str) else ""
+                h.update(f"{ds.filename!r}{modified}:{elem.value_tell}:{elem.length}".encode())
+            else:
+                h.update(elem.value or b"")
+        elif elem.VR == "SQ":
+            for item in elem.value:
+                dataset_digest(item, h)
+        elif elem.tag == 0x7FE00010:
+            h.update(elem.value if isinstance(elem.value, bytes) else bytes(elem.value))
+        else:
+            h.update(repr(elem.value).encode())
+
+
+def _digest(value, h):
+    # hash any analysis argument
+    if isinstance(value, Dataset):
+        dataset_digest(value, h)
+    elif isinstance(value, (list, tuple)):
+        h.update(b"(")
+        for v in value:
+            _digest(v, h)
+        h.update(b")")
+    elif isinstance(value, dict):
+        h.update(b"{")
+        for k in sorted(value, key=str):
+            h.update(str(k).encode())
+            _digest(value[k], h)
+        h.update(b"}")
+    elif isinstance(value, type) or callable(value):
+        h.update(f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}".encode())
+    else:
+        h.update(repr(value).encode())
+
+
+def analysis_size(args) -> int:
+    """
+    Size in bytes of the decoded pixel data of the datasets in the arguments of an analysis, worked out from their
+    headers so that no pixel data is read.
+    :param
+    args: analysis arguments
+    :return: size in bytes
+    """
+    if isinstance(args, Dataset):
+        if "PixelData" not in args:
+            return 0
+        return (args.Rows * args.Columns * int(args.get("NumberOfFrames") or 1)
+                * int(args.get("SamplesPerPixel") or 1) * args.BitsAllocated // 8)
+    if isinstance(args, (list, tuple)):
+        return sum(analysis_size(v) for v in args)
+    if isinstance(args, dict):
+        return sum(analysis_size(v) for v in args.values())
+    return 0
+
+
+def analysis_key(function, args: tuple) -> str:
+    """
+    Content address of an analysis.
+    :param
+    function: analysis function
+    args: its arguments, datasets are hashed by content
+    :return: key
+    """
+    h = hashlib.sha256()
+    _digest((function, args), h)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread safe least recently used cache of analysis results.
+    The size of a result is taken as the size of the decoded pixel data it was analysed from. Analyses that are not
+    given any datasets, e.g. those that read files themselves, are not cached as their content is not known.
+    :param
+    max_mb: size limit in megabytes, 0 disables the cache
+    """
+
+    def __init__(self, max_mb: float = 512):
+        self.max_bytes = max_mb * 2**20
+        self._results = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def set_limit(self, max_mb: float):
+        with self._lock:
+            self.max_bytes = max_mb * 2**20
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            _, (_, old_size) = self._results.popitem(last=False)
+            self._size -= old_size
+
+    def __len__(self):
+        return len(self._results)
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._results:
+                return None
+            self._results.move_to_end(key)
+            return self._results[key][0]
+
+    def fits(self, size: int) -> bool:
+        """Whether results covering size bytes of pixel data can be kept."""
+        return 0 < size <= self.max_bytes
+
+    def put(self, key: str, result, size: int):
+        if not self.fits(size):
+            return
+        with self._lock:
+            if key in self._results:
+                self._size -= self._results.pop(key)[1]
+            self._results[key] = (result, size)
+            self._size += size
+            self._evict()
+
+    def invalidate(self):
+        with self._lock:
+            self._results.clear()
+            self._size = 0
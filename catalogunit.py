@@ -0,0 +1,118 @@
+"""
+===================================
+Persistent DICOM catalog for LinaQA
+===================================
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import os
+import os.path as osp
+import sqlite3
+
+from loaderunit import DicomHeader, scan_headers
+
+catalog_name = "catalog.sqlite"
+
+
+class DicomCatalog:
+    """Header summaries of DICOM files stored in SQLite and keyed on path, modification time and size.
+    Only new or changed files are parsed, unchanged files are answered from the catalog."""
+
+    def __init__(self, db_path: str):
+        os.makedirs(osp.dirname(osp.realpath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS headers ("
+            "path TEXT PRIMARY KEY, directory TEXT, mtime INTEGER, size INTEGER, forced INTEGER, "
+            "is_dicom INTEGER, modality TEXT, series_uid TEXT, instance_number INTEGER, sop_uid TEXT, "
+            "frames INTEGER, transfer_syntax TEXT, pixel_spacing TEXT, has_pixels INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS headers_directory ON headers (directory)")
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def _lookup(self, path: str, mtime: int, size: int, forced: bool) -> tuple[bool, DicomHeader | None]:
+        # returns (found, header). header is None for a catalogued non-DICOM file
+        row = self.connection.execute(
+            "SELECT mtime, size, forced, is_dicom, modality, series_uid, instance_number, sop_uid, frames, "
+            "transfer_syntax, pixel_spacing, has_pixels FROM headers WHERE path = ?", (path,)).fetchone()
+        if row is None or row[0] != mtime or row[1] != size or bool(row[2]) != forced:
+            return False, None
+        if not row[3]:
+            return True, None
+        return True, DicomHeader(filename=path, modality=row[4], series_uid=row[5], instance_number=row[6],
+                                 sop_uid=row[7], frames=row[8], transfer_syntax=row[9], pixel_spacing=row[10],
+                                 has_pixels=bool(row[11]))
+
+    def _store(self, path: str, mtime: int, size: int, forced: bool, header: DicomHeader | None):
+        if header is None:
+            values = (path, osp.dirname(path), mtime, size, forced, False,
+                      "", "", None, "", 1, "", "", False)
+        else:
+            values = (path, osp.dirname(path), mtime, size, forced, True,
+                      header.modality, header.series_uid, header.instance_number, header.sop_uid, header.frames,
+                      header.transfer_syntax, header.pixel_spacing, header.has_pixels)
+        self.connection.execute("INSERT OR REPLACE INTO headers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                values)
+
+    def headers(self, filenames: list[str], force_read: bool = False, max_workers: int = 0,
+                progress=None) -> list[DicomHeader | None]:
+        """
+        Return the header summaries of the files in the order given, parsing only files that are not in the
+        catalog or have changed since they were catalogued.
+        :param
+        filenames: list of files
+        force_read: force pydicom to read files with bad headers
+        max_workers: number of reader threads for files that must be parsed, 0 for one per core
+        progress: optional callable(stage, done, total)
+        :return: list of DicomHeader, None where the file is not a DICOM file
+        """
+        results = [None] * len(filenames)
+        to_scan = []
+        for i, file in enumerate(filenames):
+            path = osp.realpath(file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found, header = self._lookup(path, stat.st_mtime_ns, stat.st_size, force_read)
+            if found:
+                if header is not None:
+                    header.filename = file
+                results[i] = header
+            else:
+                to_scan.append((i, file, path, stat))
+
+        scanned = scan_headers([file for _, file, _, _ in to_scan], force_read, max_workers, progress)
+        for (i, file, path, stat), header in zip(to_scan, scanned):
+            self._store(path, stat.st_mtime_ns, stat.st_size, force_read, header)
+            results[i] = header
+        self.connection.commit()
+        return results
+
+    def prune(self, dir_path: str, filenames: list[str]):
+        """Remove catalogued files in dir_path that are no longer in filenames."""
+        directory = osp.realpath(dir_path)
+        present = {osp.realpath(file) for file in filenames}
+        rows = self.connection.execute("SELECT path FROM headers WHERE directory = ?", (directory,)).fetchall()
+        stale = [(path,) for (path,) in rows if path not in present]
+        if stale:
+            self.connection.executemany("DELETE FROM headers WHERE path = ?", stale)
+            self.connection.commit()
+
+    def clear(self):
+        """Remove all entries from the catalog."""
+        self.connection.execute("DELETE FROM headers")
+        self.connection.commit()
+
+
+def open_catalog(directory: str) -> DicomCatalog | None:
+    """Open the catalog in the given directory. Returns None if the catalog cannot be opened."""
+    try:
+        return DicomCatalog(osp.join(directory, catalog_name))
+    except (OSError, sqlite3.Error):
+        return None
@@ -0,0 +1,163 @@
+"""
+==============
+Gamma analysis
+==============
+
+Gamma comparison of an evaluated dose image against a reference dose image following Low et al, Med Phys 25
+(1998) 656. For each reference pixel above the dose threshold the evaluated image is searched for the point that
+minimises gamma. The search is limited to the distance to agreement times the gamma cap and is done with a stencil of
+pixel offsets sorted by distance, so that the search stops as soon as the nearest remaining offset cannot lower gamma
+for any pixel. The image is processed in tiles of rows spread across the cores. The search is on the pixel grid, so
+the pixel spacing should be well below the distance to agreement, as it is for portal dose images.
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class GammaResult:
+    """Gamma map and its statistics. Pixels below the dose threshold are NaN in the map and are not counted."""
+    gamma: np.ndarray
+    dose_ta: float
+    dist_ta: float
+    threshold: float
+    gamma_cap: float
+    global_dose: bool
+    pass_rate: float
+    mean: float
+    maximum: float
+    evaluated: int
+    histogram: np.ndarray
+    bin_edges: np.ndarray
+
+    def summary(self) -> str:
+        lines = [f"{'Global' if self.global_dose else 'Local'} Gamma Analysis ({self.dose_ta}%/{self.dist_ta}mm, "
+                 f"threshold {100 * self.threshold:g}%)",
+                 f"Pixels evaluated: {self.evaluated}",
+                 f"Pass rate (gamma <= 1): {self.pass_rate:.2f}%",
+                 f"Mean gamma: {self.mean:.3f}",
+                 f"Maximum gamma: {self.maximum:.3f}" + (" or more" if self.maximum >= self.gamma_cap else ""),
+                 "Histogram:"]
+        for count, low, high in zip(self.histogram, self.bin_edges[:-1], self.bin_edges[1:]):
+            lines.append(f"  {low:.2f} - {high:.2f}: {100 * count / max(self.evaluated, 1):.2f}%")
+        return "\n".join(lines)
+
+
+def stencil(radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pixel offsets within a radius sorted by distance, excluding the origin.
+    :param
+    radius: search radius in pixels
+    :return: tuple of row offsets, column offsets and squared distances in pixels
+    """
+    r = int(np.ceil(radius))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    r2 = (dy * dy + dx * dx).ravel()
+    inside = (r2 > 0) & (r2 <= radius * radius)
+    order = np.argsort(r2[inside], kind="stable")
+    return dy.ravel()[inside][order], dx.ravel()[inside][order], r2[inside][order]
+
+
+def _gamma_tile(ref: np.ndarray, padded: np.ndarray, row0: int, pad: int, offsets: tuple, dose_ta: float,
+                dose_max: float | None, inv_dta2: float, cap2: float) -> np.ndarray:
+    # squared gamma for a tile of reference rows, padded holds the evaluated image padded with inf by pad pixels
+    width = padded.shape[1]
+    flat = padded.ravel()
+    best = np.full(ref.shape, np.nan, dtype=np.float32)
+    # only pixels above the threshold are searched, addressed by their index in the padded evaluated image
+    y, x = np.nonzero(~np.isnan(ref))
+    if y.size == 0:
+        return best
+    ref_values = ref[y, x]
+    # global gamma normalises the dose difference to the maximum dose, local gamma to the reference dose at the pixel
+    inv_dd2 = 1 / (dose_ta / 100 * (dose_max if dose_max is not None else ref_values)) ** 2
+    index = (y + row0 + pad) * width + x + pad
+    diff = flat[index] - ref_values
+    found = np.minimum(diff * diff * inv_dd2, cap2)
+    dys, dxs, r2s = offsets
+    shifts = dys * width + dxs
+    # offsets are sorted by distance, a pixel is done once the distance alone is more than its gamma
+    rings = np.flatnonzero(np.diff(r2s, prepend=0)).tolist() + [len(r2s)]
+    active = np.arange(y.size)
+    for start, stop in zip(rings[:-1], rings[1:]):
+        dist2 = r2s[start] * inv_dta2
+        active = active[found[active] > dist2]
+        if active.size == 0:
+            break
+        active_index = index[active]
+        active_ref = ref_values[active]
+        active_found = found[active]
+        active_dd2 = inv_dd2[active] if dose_max is None else inv_dd2
+        for shift in shifts[start:stop]:
+            diff = flat[active_index + shift]
+            diff -= active_ref
+            diff *= diff
+            diff *= active_dd2
+            diff += dist2
+            np.minimum(active_found, diff, out=active_found)
+        found[active] = active_found
+    best[y, x] = found
+    return best
+
+
+def gamma_analysis(evaluated: np.ndarray, reference: np.ndarray, pixel_mm: float, dose_ta: float = 2,
+                   dist_ta: float = 2, threshold: float = 0.05, gamma_cap: float = 2, global_dose: bool = True,
+                   tile_rows: int = 64, workers: int = 0) -> GammaResult:
+    """
+    Gamma of an evaluated dose image against a reference dose image on the same grid.
+    :param
+    evaluated: evaluated dose image
+    reference: reference dose image
+    pixel_mm: pixel spacing in mm
+    dose_ta: dose to agreement in percent of the maximum reference dose, or of the local reference dose
+    dist_ta: distance to agreement in mm
+    threshold: fraction of the maximum reference dose below which pixels are not evaluated
+    gamma_cap: gamma is searched up to this value, higher values are reported as an upper bound
+    global_dose: True to use the maximum reference dose for the dose difference, otherwise the local dose
+    tile_rows: number of rows in each tile
+    workers: number of threads, 0 for one per core
+    :return: GammaResult
+    """
+    evaluated = np.asarray(evaluated, dtype=np.float32)
+    reference = np.array(reference, dtype=np.float32)
+    if evaluated.shape != reference.shape:
+        raise ValueError(f"The images are not the same size: {evaluated.shape} vs. {reference.shape}")
+    dose_max = float(np.nanmax(reference))
+    reference[reference < threshold * dose_max] = np.nan
+    dist_px = dist_ta / pixel_mm
+    radius = dist_px * gamma_cap
+    pad = int(np.ceil(radius))
+    padded = np.pad(evaluated, pad, constant_values=np.inf)
+    offsets = stencil(radius)
+    inv_dta2 = 1 / dist_px ** 2
+    cap2 = float(gamma_cap) ** 2
+    rows = reference.shape[0]
+    starts = range(0, rows, tile_rows)
+    with ThreadPoolExecutor(max_workers=workers if workers > 0 else os.cpu_count()) as pool:
+        tiles = pool.map(lambda row0: _gamma_tile(reference[row0:row0 + tile_rows], padded, row0, pad, offsets, dose_ta,
+                                                  dose_max if global_dose else None, inv_dta2, cap2), starts)
+        gamma2 = np.vstack(list(tiles))
+    gamma = np.sqrt(gamma2, out=gamma2)
+    values = gamma[~np.isnan(gamma)]
+    # gamma is capped so the last bin holds everything at or above the cap
+    bin_edges = np.append(np.arange(0, gamma_cap, 0.25), gamma_cap)
+    histogram = np.histogram(values, bins=bin_edges)[0]
+    return GammaResult(gamma=gamma,
+                       dose_ta=dose_ta,
+                       dist_ta=dist_ta,
+                       threshold=threshold,
+                       gamma_cap=gamma_cap,
+                       global_dose=global_dose,
+                       pass_rate=100 * np.count_nonzero(values <= 1) / values.size if values.size else 0.0,
+                       mean=float(values.mean()) if values.size else 0.0,
+                       maximum=float(values.max()) if values.size else 0.0,
+                       evaluated=int(values.size),
+                       histogram=histogram,
+                       bin_edges=bin_edges)
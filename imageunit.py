@@ -3,25 +3,109 @@
 # SPDX-License-Identifier: Licence.txt:
 
 import math
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from pydicom import Dataset
 from decorators import check_values_exist
 from linaqa_types import supported_modalities
+from loaderunit import decode_pixels, decode_frame, map_frames, pixel_dtype
+
+# largest range of integer values rendered through a lookup table
+lut_limit = 2**20
+# bytes of floating point slices summed at a time
+sum_chunk_bytes = 2**25
+
+
+class LazyVolume:
+    """
+    Stands in for the volume of pixel values. Slices are only decoded from the datasets when they are asked for and
+    a limited number of decoded slices are kept. The full volume is built if it is indexed other than by slice or
+    converted to an array.
+    """
+    def __init__(self, datasets: list[Dataset], size: tuple, dtype, cache_size: int = 32):
+        self.datasets = datasets
+        self.shape = size
+        self.dtype = np.dtype(dtype)
+        self.ndim = 3
+        self.cache_size = max(cache_size, 1)
+        self._slices = OrderedDict()
+        self._frames = None
+        self._multi_frame = ((int(datasets[0].get("SamplesPerPixel") or 1) != 3)
+                             and (int(datasets[0].get("NumberOfFrames") or 1) > 1))
+
+    def _decode(self, index: int) -> np.ndarray:
+        if self._multi_frame:
+            frame = None if self._frames is not None else decode_frame(self.datasets[0], index)
+            if frame is None:
+                # the frames cannot be read individually so decode them all once
+                if self._frames is None:
+                    self._frames = decode_pixels(self.datasets[0])
+                frame = self._frames[index]
+            return frame
+        arr = decode_pixels(self.datasets[index])
+        if arr.ndim == 3:
+            # Convert RBG image to Grayscale
+            arr = np.dot(arr[..., :3], [0.2989, 0.5870, 0.1140])
+        return arr.astype(self.dtype, casting="unsafe", copy=False)
+
+    def get_slice(self, index: int) -> np.ndarray:
+        if index in self._slices:
+            self._slices.move_to_end(index)
+        else:
+            self._slices[index] = self._decode(index)
+            while len(self._slices) > self.cache_size:
+                self._slices.popitem(last=False)
+        return self._slices[index]
+
+    def __getitem__(self, key):
+        if (isinstance(key, tuple) and (len(key) == 3) and (key[0] == slice(None)) and (key[1] == slice(None))
+                and isinstance(key[2], (int, np.integer))):
+            return self.get_slice(int(key[2]))
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        # the owner must hold its render lock, the slice cache is shared with its prefetch thread
+        volume = np.empty(self.shape, dtype=self.dtype if dtype is None else dtype)
+        for i in range(self.shape[2]):
+            volume[:, :, i] = self._slices[i] if i in self._slices else self._decode(i)
+        return volume
 
 
 class Imager:
-    def __init__(self, datasets: list[Dataset], use_rescale: bool = False):
+    def __init__(self, datasets: list[Dataset], use_rescale: bool = False, lazy: bool = False, cache_size: int = 32,
+                 memory_map_mb: int = 0):
         self.datasets = datasets
         self.values = None
+        # False once the values have been changed so that they no longer match the pixel data of the datasets
+        self.values_decoded = False
+        self.lazy = lazy
+        self.cache_size = cache_size
+        # volumes larger than this are memory mapped, 0 to keep all volumes in memory
+        self.memory_map_mb = memory_map_mb
+        self._spool = None
         self._index = 0
         self.rescale = use_rescale
         self._window_width = 1000
         self._window_center = 0
         self._invflag = False
+        self._lut = None
+        self._lut_key = None
+        self._ranges = {}
+        self._reduced = OrderedDict()
+        self._frames = OrderedDict()
+        # rendering is shared with the background prefetch thread
+        self._render_lock = threading.Lock()
+        self._generation = 0
+        self._prefetch_id = 0
+        self._prefetcher = None
 
         # check if dataset has an image
-        if (datasets[0].Modality in supported_modalities) and hasattr(datasets[0], "PixelData"):
+        # test with "in" so that pixel data left in the file is not read
+        if (datasets[0].Modality in supported_modalities) and ("PixelData" in datasets[0]):
 
             # Dataset has 3D volume
             if hasattr(datasets[0], "NumberOfFrames") and (int(datasets[0].NumberOfFrames) > 1):
@@ -57,21 +141,82 @@ class Imager:
             self.auto_window()
 
     def load_pixel_data(self, datasets):
-        # standard set of 2D images
-        if datasets[0].pixel_array.ndim == 2:
-            self.values = np.zeros(self.size, dtype="int32")
-            for i, d in enumerate(datasets):
-                # Also performs rescaling. "unsafe' since it converts from float64 to int32
-                np.copyto(self.values[:, :, i], d.pixel_array, 'unsafe')
-        # colour image 3 sample RGB per pixel
-        elif (datasets[0].pixel_array.ndim == 3) and (hasattr(datasets[0], "SamplesPerPixel")) and (datasets[0].SamplesPerPixel == 3):
-            self.values = np.zeros((self.size[0], self.size[1], len(datasets)), dtype='int32')
-            for i, d in enumerate(datasets):
-                # Convert RBG image to Grayscale
-                np.copyto(self.values[:, :, i], np.dot(d.pixel_array[...,:3], [0.2989, 0.5870, 0.1140]), 'unsafe')
+        self.clear_render_cache()
+        self.values_decoded = True
+        self.load_rescale(datasets)
+        # slices are stored in the data type they were decoded to, the widest one if they differ
+        multi_frame = hasattr(datasets[0], "NumberOfFrames") and (int(datasets[0].NumberOfFrames) > 1)
+        dtype = pixel_dtype(datasets[0]) if multi_frame else np.result_type(*[pixel_dtype(d) for d in datasets])
+        nbytes = self.size[0] * self.size[1] * self.size[2] * dtype.itemsize
+        # very large volumes are paged in from disk
+        if (self.memory_map_mb > 0) and (nbytes > self.memory_map_mb * 2**20):
+            self.values = self.map_volume(datasets, dtype, multi_frame)
+        # decode slices as they are displayed
+        elif self.lazy:
+            self.values = LazyVolume(datasets, self.size, dtype, self.cache_size)
         # multi-frame image or 3D image
-        elif datasets[0].pixel_array.ndim == 3:
-            self.values = datasets[0].pixel_array.transpose(1, 2, 0)
+        elif multi_frame and (datasets[0].get("SamplesPerPixel", 1) != 3):
+            self.values = decode_pixels(datasets[0]).transpose(1, 2, 0)
+        else:
+            self.values = np.empty(self.size, dtype=dtype)
+            self.decode_slices(datasets, self.values)
+
+    @staticmethod
+    def decode_slices(datasets, values):
+        for i, d in enumerate(datasets):
+            arr = decode_pixels(d)
+            # colour image 3 sample RGB per pixel
+            if arr.ndim == 3:
+                # Convert RBG image to Grayscale
+                arr = np.dot(arr[..., :3], [0.2989, 0.5870, 0.1140])
+            # 'unsafe' since it converts the grayscale from float64
+            np.copyto(values[:, :, i], arr, 'unsafe')
+
+    def map_volume(self, datasets, dtype, multi_frame: bool) -> np.ndarray:
+        # map uncompressed frames straight from the file if the pixel data was left there
+        if multi_frame:
+            frames = map_frames(datasets[0])
+            if frames is not None:
+                return frames.transpose(1, 2, 0)
+        # otherwise spool the decoded slices to a temporary file, slice by slice so each slice is contiguous on disk
+        self._spool = tempfile.TemporaryFile(prefix="linaqa")
+        values = np.memmap(self._spool, dtype=dtype, mode="w+",
+                           shape=(self.size[2], self.size[0], self.size[1])).transpose(1, 2, 0)
+        if multi_frame and (datasets[0].get("SamplesPerPixel", 1) != 3):
+            values[:] = decode_pixels(datasets[0]).transpose(1, 2, 0)
+        else:
+            self.decode_slices(datasets, values)
+        return values
+
+    def load_rescale(self, datasets):
+        # rescale slope and intercept of each slice, multi-frame images share those of the first dataset
+        self.slopes = np.ones(self.size[2])
+        self.intercepts = np.zeros(self.size[2])
+        for i, d in enumerate(datasets[:self.size[2]]):
+            if hasattr(d, 'RescaleIntercept') and hasattr(d, 'RescaleSlope'):
+                self.slopes[i] = float(d.RescaleSlope)
+                self.intercepts[i] = float(d.RescaleIntercept)
+        if len(datasets) < self.size[2]:
+            self.slopes[:] = self.slopes[0]
+            self.intercepts[:] = self.intercepts[0]
+
+    def frames_volume(self) -> np.ndarray | None:
+        """
+        The decoded pixel data, frames first, for analyses to share instead of decoding the datasets again. A lazily
+        decoded volume is built in full and kept for later analyses.
+        :return: view of the values, or None if the values have been changed since they were decoded
+        """
+        if (not self.values_decoded) or (self.values is None):
+            return None
+        self.load_volume()
+        return self.values.transpose(2, 0, 1)
+
+    def load_volume(self):
+        # replace a lazily decoded volume with the full volume before it is processed as a whole
+        # the slice cache is shared with the prefetch thread
+        with self._render_lock:
+            if isinstance(self.values, LazyVolume):
+                self.values = np.asarray(self.values)
 
     @property
     def index(self):
@@ -109,47 +254,139 @@ class Imager:
     def invflag(self, value: bool):
         self._invflag = value
 
-    @check_values_exist
-    def get_image(self, index):
-        # int32 true values (HU or brightness units)
-        img = self.values[:, :, index]
-        if (self.rescale and hasattr(self.datasets[index], 'RescaleIntercept')
-           and hasattr(self.datasets[index], 'RescaleSlope')):
-            intercept = float(self.datasets[index].RescaleIntercept)
-            slope = float(self.datasets[index].RescaleSlope)
-            img = img*slope + intercept
-
-        # Vectorized windowing using boolean masks
+    def _rescale_params(self, index) -> tuple[float, float]:
+        # slope and intercept of the slice
+        if self.rescale:
+            return float(self.slopes[index]), float(self.intercepts[index])
+        return 1.0, 0.0
+
+    def _window(self, img, slope: float, intercept: float) -> np.ndarray:
+        # map values to 8 bit grey levels with the current window, level and inversion
         w_left = (self._window_center - self._window_width / 2)
         w_right = (self._window_center + self._window_width / 2)
-        mask_0 = img < w_left
-        mask_1 = img > w_right
-        mask_2 = np.invert(mask_0 + mask_1)
-
-        # Cast to RGB image so that QImage can handle it
-        rgb_array = np.zeros((img.shape[0], img.shape[1], 3), dtype=np.uint32)
+        img = img*slope + intercept
         if self._invflag:
-            rgb_array[:, :, 0] = rgb_array[:, :, 1] = rgb_array[:, :, 2] = \
-                mask_1 * 0 + mask_0 * 255 + mask_2 * (255 * (w_right - img) / (w_right - w_left))
+            grey = 255 * (w_right - img) / (w_right - w_left)
         else:
-            rgb_array[:, :, 0] = rgb_array[:, :, 1] = rgb_array[:, :, 2] = \
-                mask_0 * 0 + mask_1 * 255 + mask_2 * (255 * (img - w_left) / (w_right - w_left))
+            grey = 255 * (img - w_left) / (w_right - w_left)
+        return np.clip(grey, 0, 255).astype(np.uint8)
 
-        # flatten RGB array to RGB32
-        res = (255 << 24 | rgb_array[:, :, 0] << 16 | rgb_array[:, :, 1] << 8 | rgb_array[:, :, 2])
-        return res
+    def _get_lut(self, first: int, length: int, slope: float, intercept: float, wrap: bool = False) -> np.ndarray:
+        # the lookup table is only rebuilt when the window or the values it covers change
+        key = (first, length, wrap, slope, intercept, self._window_center, self._window_width, self._invflag)
+        if key != self._lut_key:
+            self._lut = self._window(np.arange(first, first + length, dtype=np.float64), slope, intercept)
+            if wrap:
+                # signed values are looked up through their unsigned view, so the negative values go at the end
+                self._lut = np.roll(self._lut, first)
+            self._lut_key = key
+        return self._lut
 
-    def get_current_image(self):
-        return self.get_image(self.index)
+    def _get_range(self, key, img) -> tuple[int, int]:
+        if key not in self._ranges:
+            self._ranges[key] = (int(np.min(img)), int(np.max(img)))
+        return self._ranges[key]
+
+    def _reduce(self, index, img, size) -> tuple[np.ndarray, int]:
+        # area average the slice by the largest whole factor that keeps it at least as large as size (width, height)
+        if size is None:
+            return img, 1
+        factor = int(max(img.shape[1] / max(size[0], 1), img.shape[0] / max(size[1], 1)))
+        if factor < 2:
+            return img, 1
+        key = (index, factor)
+        if key in self._reduced:
+            self._reduced.move_to_end(key)
+        else:
+            rows = img.shape[0] // factor * factor
+            columns = img.shape[1] // factor * factor
+            reduced = img[:rows, :columns].reshape(rows // factor, factor, columns // factor, factor).mean(axis=(1, 3))
+            if img.dtype.kind in "iu":
+                # keep integer values so the slice can still be rendered through the lookup table
+                reduced = np.rint(reduced).astype(img.dtype)
+            self._reduced[key] = reduced
+            while len(self._reduced) > self.cache_size:
+                self._reduced.popitem(last=False)
+        return self._reduced[key], factor
+
+    def clear_render_cache(self):
+        # must be called before the pixel values change, also stops any prefetch
+        self._generation += 1
+        with self._render_lock:
+            self._ranges = {}
+            self._reduced = OrderedDict()
+            self._frames = OrderedDict()
+            self._lut_key = None
+
+    @check_values_exist
+    def get_image(self, index, size: tuple[int, int] | None = None):
+        # returns the slice as 8 bit grey levels windowed through a lookup table
+        # if size (width, height) is given the slice is first reduced to no less than that size
+        with self._render_lock:
+            return self._render(index, size)
+
+    def _render(self, index, size) -> np.ndarray:
+        # rendered slices are kept for the window they were rendered with
+        key = (index, size, self._window_center, self._window_width, self._invflag, self.rescale)
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return self._frames[key]
+        img, factor = self._reduce(index, self.values[:, :, index], size)
+        slope, intercept = self._rescale_params(index)
+        if img.dtype.kind == "u" and img.dtype.itemsize <= 2:
+            lut = self._get_lut(0, 2**(8*img.dtype.itemsize), slope, intercept)
+            grey = lut[img]
+        elif img.dtype.kind == "i" and img.dtype.itemsize <= 2:
+            lut = self._get_lut(-2**(8*img.dtype.itemsize - 1), 2**(8*img.dtype.itemsize), slope, intercept, wrap=True)
+            grey = lut[img.view(img.dtype.str.replace("i", "u"))]
+        elif img.dtype.kind in "iu":
+            v_min, v_max = self._get_range((index, factor), img)
+            if v_max - v_min < lut_limit:
+                first = 0 if (v_min >= 0) and (v_max < lut_limit) else v_min
+                lut = self._get_lut(first, v_max - first + 1, slope, intercept)
+                grey = lut[img] if first == 0 else lut[img - first]
+            else:
+                grey = self._window(img, slope, intercept)
+        else:
+            # floating point values are windowed directly
+            grey = self._window(img, slope, intercept)
+        self._frames[key] = np.ascontiguousarray(grey)
+        while len(self._frames) > self.cache_size:
+            self._frames.popitem(last=False)
+        return self._frames[key]
+
+    def prefetch(self, step: int, count: int, size: tuple[int, int] | None = None):
+        # render the count slices following the current slice in the direction of step in the background
+        # so that scrolling to them is immediate
+        if (self.values is None) or (step == 0) or (count < 1):
+            return
+        if self._prefetcher is None:
+            self._prefetcher = ThreadPoolExecutor(max_workers=1)
+        # a new request supersedes any prefetch still running
+        self._prefetch_id += 1
+        indices = [self.index + step * i for i in range(1, count + 1) if 0 <= self.index + step * i < self.size[2]]
+        self._prefetcher.submit(self._prefetch, self._prefetch_id, self._generation, indices, size)
+
+    def _prefetch(self, prefetch_id: int, generation: int, indices: list[int], size):
+        for index in indices:
+            with self._render_lock:
+                if (prefetch_id != self._prefetch_id) or (generation != self._generation):
+                    return
+                self._render(index, size)
+
+    def get_current_image(self, size: tuple[int, int] | None = None):
+        return self.get_image(self.index, size)
 
     @check_values_exist
     def auto_window(self):
-        win_max = np.max(self.values)
-        win_min = np.min(self.values)
-        if (self.rescale and hasattr(self.datasets[self.index], 'RescaleIntercept')
-                and hasattr(self.datasets[self.index], 'RescaleSlope')):
-            intercept = float(self.datasets[self.index].RescaleIntercept)
-            slope = float(self.datasets[self.index].RescaleSlope)
+        # only the current slice is decoded in lazy mode
+        with self._render_lock:
+            values = self.values[:, :, self.index] if isinstance(self.values, LazyVolume) else self.values
+        # plain numbers so that the window arithmetic does not wrap or overflow in the pixel data type
+        win_max = float(np.max(values))
+        win_min = float(np.min(values))
+        if self.rescale:
+            slope, intercept = self._rescale_params(self.index)
             win_max = win_max * slope + intercept
             win_min = win_min * slope + intercept
         self._window_width = win_max-win_min
@@ -157,26 +394,46 @@ class Imager:
 
     @check_values_exist
     def flip_lr(self):
+        self.clear_render_cache()
+        self.load_volume()
+        self.values_decoded = False
         self.values = np.fliplr(self.values)
 
     @check_values_exist
     def flip_ud(self):
+        self.clear_render_cache()
+        self.load_volume()
+        self.values_decoded = False
         self.values = np.flipud(self.values)
 
     @check_values_exist
     def sum_images(self):
+        self.clear_render_cache()
+        self.values_decoded = False
         # collapse the images into one image.
         if self.values.ndim == 3:
-            # create floating point matrix same size as values
-            fpvalues = np.array(self.values, dtype=float)
-            # for each image rescale pixel values to calibrated units.
-            for i, ds in enumerate(self.datasets):
-                slope = ds.RescaleSlope if hasattr(ds, 'RescaleSlope') else 1
-                intercept = ds.RescaleIntercept if hasattr(ds, 'RescaleIntercept') else 0
-                sign = ds.PixelIntensityRelationship if hasattr(ds, 'PixelIntensityRelationship') \
-                    else math.copysign(1, slope)
-                fpvalues[:, :, i] = fpvalues[:, :, i]*slope + intercept
-            image_sum = np.sum(fpvalues, axis=2)
+            ds = self.datasets[-1]
+            slope = ds.RescaleSlope if hasattr(ds, 'RescaleSlope') else 1
+            sign = ds.PixelIntensityRelationship if hasattr(ds, 'PixelIntensityRelationship') \
+                else math.copysign(1, slope)
+            # rescale each image to calibrated units and add them up. The rescaled sum is the sum of the slices
+            # weighted by their slopes plus the sum of the intercepts. The slices are taken a chunk at a time so that
+            # only a chunk is ever held in floating point, and lazily decoded slices are not built into a volume.
+            rows, columns, count = self.values.shape
+            chunk = max(1, sum_chunk_bytes // (rows * columns * 8))
+            image_sum = np.full((rows, columns), np.sum(self.intercepts[:count]))
+            for start in range(0, count, chunk):
+                stop = min(start + chunk, count)
+                if isinstance(self.values, LazyVolume):
+                    with self._render_lock:
+                        frames = np.stack([self.values.get_slice(i) for i in range(start, stop)])
+                else:
+                    frames = self.values[:, :, start:stop].transpose(2, 0, 1)
+                # weight the slices in the order they lie in memory, frame by frame or pixel by pixel
+                if frames.strides[0] >= frames.strides[1]:
+                    image_sum += np.tensordot(self.slopes[start:stop], frames, axes=1)
+                else:
+                    image_sum += np.matmul(frames.transpose(1, 2, 0), self.slopes[start:stop])
             if sign == 1:   # if sign=1 pixel values increase with x-ray intensity
                 # get slope to rescale values to max int16
                 intercept = np.min(image_sum)
@@ -196,13 +453,16 @@ class Imager:
             self.datasets[0].RescaleSlope = slope
             self.datasets[0].RescaleIntercept = intercept
             self.datasets[0].RescaleType = 'CU'
-            for image in self.datasets[1:]:
-                self.datasets.remove(image)
+            del self.datasets[1:]
+            self.load_rescale(self.datasets)
             self.index = 0
             self.auto_window()
 
     @check_values_exist
     def avg_images(self):
+        self.clear_render_cache()
+        self.load_volume()
+        self.values_decoded = False
         # collapse the images into one image.
         if self.values.ndim == 3:
             image_sum = np.sum(self.values, axis=2)
@@ -212,11 +472,15 @@ class Imager:
             self.values = image_sum.reshape(int(self.datasets[0].Rows),  int(self.datasets[0].Columns), 1)
             for image in self.datasets[1:]:
                 self.datasets.remove(image)
+            self.load_rescale(self.datasets)
             self.index = 0
             self.auto_window()
 
     @check_values_exist
     def scale_images(self, factor: float):
+        self.clear_render_cache()
+        self.load_volume()
+        self.values_decoded = False
         self.values = self.values*factor
         if self.datasets[0].pixel_array.ndim == 3:
             self.datasets[0].PixelData = self.values.astype(np.uint16, casting='unsafe').tobytes()
@@ -0,0 +1,296 @@
+"""
+=============================
+DICOM file loading for LinaQA
+=============================
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import os
+import copy
+from collections.abc import MutableSequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+
+import numpy as np
+import pydicom
+from pydicom import Dataset
+
+
+@dataclass
+class DicomHeader:
+    """Summary of the header of a DICOM file used to select and sort files before the pixel data is read."""
+    filename: str
+    modality: str = ""
+    series_uid: str = ""
+    instance_number: int | None = None
+    sop_uid: str = ""
+    frames: int = 1
+    transfer_syntax: str = ""
+    pixel_spacing: str = ""
+    has_pixels: bool = False
+
+
+def read_header(filename: str, force_read: bool = False) -> DicomHeader | None:
+    """Read only the header of a DICOM file. Returns None if the file is not a DICOM file."""
+    try:
+        ds = pydicom.dcmread(filename, force=force_read, stop_before_pixels=True)
+    except (pydicom.errors.InvalidDicomError, OSError):
+        return None
+    try:
+        instance_number = int(ds.InstanceNumber) if ds.get("InstanceNumber") is not None else None
+    except (TypeError, ValueError):
+        instance_number = None
+    spacing = ds.get("PixelSpacing", ds.get("ImagePlanePixelSpacing"))
+    return DicomHeader(
+        filename=filename,
+        modality=str(ds.get("Modality", "")),
+        series_uid=str(ds.get("SeriesInstanceUID", "")),
+        instance_number=instance_number,
+        sop_uid=str(ds.get("SOPInstanceUID", "")),
+        frames=int(ds.get("NumberOfFrames") or 1),
+        transfer_syntax=str(ds.file_meta.get("TransferSyntaxUID", "")) if hasattr(ds, "file_meta") else "",
+        pixel_spacing="\\".join(str(s) for s in spacing) if spacing is not None else "",
+        # the pixel data follows the image pixel module, so Rows stands in for it in a header only read
+        has_pixels="Rows" in ds)
+
+
+def read_dataset(filename: str, force_read: bool = False, defer_size: int | None = None) -> Dataset:
+    """
+    Read a DICOM file, fill in missing tags LinaQA relies on and decompress the pixel data.
+    Uncompressed elements larger than defer_size bytes are left in the file until they are used.
+    """
+    ds = pydicom.dcmread(filename, force=force_read, defer_size=defer_size)
+    if "TransferSyntaxUID" not in ds.file_meta:
+        ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
+    if "SpacingBetweenSlices" not in ds:
+        ds.SpacingBetweenSlices = ds.SliceThickness if "SliceThickness" in ds else 1
+    if ds.file_meta.TransferSyntaxUID.is_compressed and "PixelData" in ds:
+        ds.decompress()
+        release_pixels(ds)
+    return ds
+
+
+def release_pixels(ds: Dataset):
+    """Drop the decoded pixel array pydicom keeps in the dataset. It is decoded again if it is asked for."""
+    ds._pixel_array = None
+    ds._pixel_id = {}
+
+
+def copy_dataset(ds: Dataset) -> Dataset:
+    """
+    Copy of a dataset that can be changed, e.g. in the tag editor, without changing the copy. Each data element is
+    copied but the pixel data bytes are shared, as they are only ever replaced and not changed in place, and elements
+    left in the file by a deferred read stay there. The decoded pixel array is not kept as the pixel data table edits
+    it in place, it is decoded again from the pixel data if it is asked for.
+    """
+    new = ds.copy()
+    new._dict = {}
+    for tag in ds.keys():
+        elem = raw_element(ds, tag)
+        if isinstance(elem, pydicom.dataelem.RawDataElement):
+            # raw elements are tuples so cannot be changed
+            new._dict[tag] = elem
+        elif elem.VR == "SQ":
+            new._dict[tag] = copy.copy(elem)
+            new._dict[tag].value = [copy_dataset(item) for item in elem.value]
+        elif isinstance(elem.value, MutableSequence):
+            new._dict[tag] = copy.deepcopy(elem)
+        else:
+            new._dict[tag] = copy.copy(elem)
+    if hasattr(ds, "file_meta"):
+        new.file_meta = copy.deepcopy(ds.file_meta)
+    release_pixels(new)
+    return new
+
+
+def decode_pixels(ds: Dataset) -> np.ndarray:
+    """Decode the pixel data of a dataset without keeping the decoded array in the dataset."""
+    arr = ds.pixel_array
+    release_pixels(ds)
+    return arr
+
+
+def copy_pixels(ds: Dataset) -> np.ndarray:
+    """Return a writeable copy of the decoded pixel data. An array already decoded in the dataset is left there."""
+    decoded = getattr(ds, "_pixel_array", None) is not None
+    arr = ds.pixel_array.copy()
+    if not decoded:
+        release_pixels(ds)
+    return arr
+
+
+def pixel_dtype(ds: Dataset) -> np.dtype:
+    """Numpy data type pydicom decodes the pixel data of a dataset to, found from the header alone."""
+    bits = int(ds.get("BitsAllocated") or 16)
+    signed = ds.get("PixelRepresentation", 0) == 1
+    size = 1 if bits <= 8 else 2 if bits <= 16 else 4 if bits <= 32 else 8
+    return np.dtype(f"{'i' if signed else 'u'}{size}")
+
+
+def native_dtype(ds: Dataset) -> np.dtype | None:
+    """
+    Data type of uncompressed pixel data that can be used as it is stored, without unpacking or sign extension.
+    :return: numpy dtype in the byte order of the file or None
+    """
+    ts = ds.file_meta.get("TransferSyntaxUID") if hasattr(ds, "file_meta") else None
+    bits = int(ds.get("BitsAllocated") or 0)
+    signed = ds.get("PixelRepresentation", 0) == 1
+    if ((ts is None) or ts.is_compressed or ("PixelData" not in ds) or (bits not in (8, 16, 32))
+            or (int(ds.get("SamplesPerPixel") or 1) != 1)
+            # pydicom sign extends signed values that do not fill the allocated bits
+            or (signed and int(ds.get("BitsStored") or bits) != bits)):
+        return None
+    return np.dtype(f"{'i' if signed else 'u'}{bits // 8}").newbyteorder("<" if ts.is_little_endian else ">")
+
+
+def decode_frame(ds: Dataset, index: int) -> np.ndarray | None:
+    """
+    Return one frame of a multi-frame dataset as a view on its uncompressed pixel data.
+    :return: 2D array or None if the pixel data is compressed or cannot be viewed directly, in which case the whole
+    image must be decoded
+    """
+    dtype = native_dtype(ds)
+    if dtype is None:
+        return None
+    rows, columns = int(ds.Rows), int(ds.Columns)
+    count = rows * columns
+    return np.frombuffer(ds.PixelData, dtype=dtype, count=count,
+                         offset=index * count * dtype.itemsize).reshape(rows, columns)
+
+
+def raw_element(ds: Dataset, tag):
+    """
+    Element of a dataset as it is stored, without reading a deferred element from the file or converting a raw one.
+    :return: DataElement, RawDataElement or None if the dataset does not have the element
+    """
+    try:
+        return ds.get_item(tag, keep_deferred=True)
+    except TypeError:
+        # pydicom 2 reads deferred elements in get_item
+        return ds._dict.get(pydicom.tag.Tag(tag))
+
+
+def map_frames(ds: Dataset) -> np.ndarray | None:
+    """
+    Memory map the frames of a multi-frame dataset whose pixel data was left in the file by a deferred read.
+    :return: read only array of shape (frames, rows, columns) or None if the pixel data cannot be mapped
+    """
+    elem = raw_element(ds, "PixelData")
+    dtype = native_dtype(ds)
+    filename = ds.filename if isinstance(ds.filename, str) else None
+    if ((dtype is None) or (filename is None) or (getattr(elem, "value", None) is not None)
+            or (getattr(elem, "value_tell", None) is None)):
+        return None
+    shape = (int(ds.get("NumberOfFrames") or 1), int(ds.Rows), int(ds.Columns))
+    if elem.length < shape[0] * shape[1] * shape[2] * dtype.itemsize:
+        return None
+    return np.memmap(filename, dtype=dtype, mode="r", offset=elem.value_tell, shape=shape)
+
+
+def run_pool(function, items: list, max_workers: int = 0, progress=None, stage: str = "") -> list:
+    """
+    Apply function to each item on a thread pool and return the results in the order of the items.
+    Exceptions raised by function are returned as None.
+    :param
+    function: callable taking a single item
+    items: list of items to process
+    max_workers: number of threads, 0 for one per core
+    progress: optional callable(stage, done, total) called from the calling thread as each item completes
+    stage: text passed through to progress
+    """
+    results = [None] * len(items)
+    if not items:
+        return results
+    workers = max_workers if max_workers > 0 else (os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        futures = {executor.submit(function, item): i for i, item in enumerate(items)}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                results[futures[future]] = future.result()
+            except (pydicom.errors.InvalidDicomError, AttributeError, ValueError, OSError):
+                results[futures[future]] = None
+            if progress is not None:
+                progress(stage, done, len(items))
+    return results
+
+
+def scan_headers(filenames: list[str], force_read: bool = False, max_workers: int = 0,
+                 progress=None) -> list[DicomHeader | None]:
+    """Read the headers of all files without their pixel data."""
+    return run_pool(lambda file: read_header(file, force_read), filenames, max_workers, progress, "Scanning")
+
+
+def sort_headers(headers: list[DicomHeader]) -> tuple[list[DicomHeader], str]:
+    """Try to sort based on instance number then SOPInstanceUID. Returns the sorted list and the sort method."""
+    if all(h.instance_number is not None for h in headers):
+        return sorted(headers, key=lambda h: h.instance_number), "instance number"
+    if all(h.sop_uid != "" for h in headers):
+        return sorted(headers, key=lambda h: h.sop_uid), "SOP instance UID"
+    return headers, "filenames"
+
+
+def group_headers(headers: list[DicomHeader | None]) -> list[list[DicomHeader]]:
+    """
+    Group the scanned files into series by SeriesInstanceUID and then by modality.
+    Multi-frame images and files without pixel data cannot be stacked and form a series on their own.
+    Series are returned in the order their first file appears in headers.
+    """
+    groups = {}
+    for h in headers:
+        if h is None:
+            continue
+        if (h.frames > 1) or not h.has_pixels:
+            key = (h.filename,)
+        else:
+            key = (h.series_uid, h.modality)
+        groups.setdefault(key, []).append(h)
+    return list(groups.values())
+
+
+def scan_series(filenames: list[str],
+                force_read: bool = False,
+                max_workers: int = 0,
+                progress=None,
+                catalog=None) -> tuple[list[list[DicomHeader]], int]:
+    """
+    Read only the headers of a set of files and group them into series.
+    :param
+    filenames: list of files to scan
+    force_read: force pydicom to read files with bad headers
+    max_workers: number of reader threads, 0 for one per core
+    progress: optional callable(stage, done, total) called from the calling thread as each file completes
+    catalog: optional DicomCatalog to answer the header pass for files that have not changed
+    :return: tuple of the list of series and the number of files that are not DICOM files
+    """
+    if catalog is not None:
+        headers = catalog.headers(filenames, force_read, max_workers, progress)
+    else:
+        headers = scan_headers(filenames, force_read, max_workers, progress)
+    return group_headers(headers), headers.count(None)
+
+
+def read_series(series: list[DicomHeader],
+                force_read: bool = False,
+                max_workers: int = 0,
+                progress=None,
+                defer_size: int | None = None) -> tuple[list[Dataset], list[str], str]:
+    """
+    Read and decompress the pixel data of one series from scan_series on a thread pool.
+    Uncompressed pixel data larger than defer_size bytes is left in the file so it can be memory mapped.
+    :return: tuple of sorted datasets, their filenames and the sort method
+    """
+    sorted_series, sorted_method = sort_headers(series)
+    if len(series) == 1:
+        sorted_method = "None"
+    datasets = run_pool(lambda h: read_dataset(h.filename, force_read, defer_size), sorted_series, max_workers,
+                        progress, "Loading")
+    read_sets = []
+    read_names = []
+    for h, ds in zip(sorted_series, datasets):
+        # the header scan cannot see the pixel data, so drop any image that turns out to have none
+        if ds is not None and (len(sorted_series) == 1 or "PixelData" in ds):
+            read_sets.append(ds)
+            read_names.append(h.filename)
+    return read_sets, read_names, sorted_method
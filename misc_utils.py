@@ -11,6 +11,7 @@ import os
 import io
 import subprocess
 from pydicom import FileDataset
+from pylinac.core.image import DicomImage
 
 
 def open_path(path: str) -> bool:
@@ -128,3 +129,17 @@ def datasets_to_stream(ds_list: list) -> io.BytesIO():
     # Create a list of individual file streams
     file_streams = [dataset_to_stream(ds) for ds in ds_list]
     return file_streams
+
+
+def dataset_to_image(ds: FileDataset):
+    """
+    Build a pylinac DicomImage straight from the dataset in memory. pylinac_subclasses must have been imported to
+    allow this. Falls back to a stream if the image cannot be built directly.
+    :param
+    ds: dataset with pixel data
+    :return: DicomImage or stream, either of which can be passed to pylinac's image.load
+    """
+    try:
+        return DicomImage(ds)
+    except (AttributeError, TypeError):
+        return dataset_to_stream(ds)
@@ -0,0 +1,274 @@
+"""
+====================
+Picket Fence batches
+====================
+
+Runs many picket fence images, e.g. the sessions of several days or machines, through the picket fence analysis and
+collects the leaf errors into one table. The images are analysed in a pool of processes. The table has a row per
+leaf and a column per session with the largest error of the leaf in that session.
+Usage: python pfbatchunit.py /path/to/images [/path/to/more] [-o /path/to/reports]
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import io
+import os
+import os.path as osp
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+import matplotlib.pyplot as plt
+from pylinac import picketfence
+from pylinac.core import pdf
+
+from loaderunit import scan_series
+import batchunit
+
+
+def mlc_arrangement(mlc: str) -> picketfence.MLCArrangement:
+    """
+    Leaf arrangement of an MLC model.
+    :param
+    mlc: name of the MLC as shown in the MLC list, e.g. "HD Millennium"
+    :return: MLCArrangement
+    """
+    for member in picketfence.MLC:
+        if member.value["name"] == mlc:
+            return member.value["arrangement"]
+    raise ValueError(f"Unknown MLC {mlc}")
+
+
+def session_name(ds, filename: str) -> str:
+    # date and time the image was taken followed by the file name
+    date = ds.get("AcquisitionDate") or ds.get("ContentDate") or ds.get("StudyDate") or ""
+    acquired = ds.get("AcquisitionTime") or ds.get("ContentTime") or ds.get("StudyTime") or ""
+    stamp = f"{date[:4]}-{date[4:6]}-{date[6:8]} {acquired[:2]}:{acquired[2:4]}" if len(date) == 8 else ""
+    return f"{stamp} {osp.basename(filename)}".strip()
+
+
+def analyse_image(filename: str, arrangement: picketfence.MLCArrangement, pf_filter: int | None,
+                  params: dict) -> dict:
+    """
+    Analyse one picket fence image. Runs in a worker process.
+    :param
+    filename: name of the image file
+    arrangement: MLC leaf arrangement
+    pf_filter: size of the median filter or None
+    params: keyword parameters for analyze
+    :return: dictionary of the session results with the errors of each leaf for each picket
+    """
+    start = time.perf_counter()
+    record = {"file": filename, "session": osp.basename(filename)}
+    try:
+        pf = picketfence.PicketFence(filename, mlc=arrangement, filter=pf_filter)
+        try:
+            pf.analyze(**params)
+        except ValueError:
+            # if it throws an exception fall back to this as per issue #470
+            pf.analyze(**params, required_prominence=0.1)
+        data = pf.results_data()
+        record.update({"session": session_name(pf.image.metadata, filename),
+                       "passed": bool(data.passed),
+                       "max_error_mm": float(data.max_error_mm),
+                       "absolute_median_error_mm": float(data.absolute_median_error_mm),
+                       "percent_leaves_passing": float(data.percent_leaves_passing),
+                       "number_of_pickets": int(data.number_of_pickets),
+                       "leaf_errors": {int(leaf): [float(e) for e in errors]
+                                       for leaf, errors in data.mlc_errors_by_leaf.items()}})
+    except Exception as e:
+        record["error"] = repr(e)
+    record["seconds"] = round(time.perf_counter() - start, 2)
+    return record
+
+
+class PicketFenceBatch:
+    """
+    Consolidated results of a batch of picket fence images.
+    :param
+    mlc: name of the MLC
+    tolerance: leaf tolerance in mm
+    """
+    _model = "Picket Fence Batch"
+
+    def __init__(self, mlc: str, tolerance: float):
+        self.mlc = mlc
+        self.tolerance = tolerance
+        self.records = []
+
+    def add(self, record: dict):
+        self.records.append(record)
+        self.records.sort(key=lambda r: r["session"])
+
+    @property
+    def analysed(self) -> list[dict]:
+        return [r for r in self.records if "error" not in r]
+
+    def leaf_table(self) -> tuple[list[str], list[list]]:
+        """
+        Largest absolute error of each leaf in each session. Leaves that no session measured are left out.
+        :return: tuple of the column headings and the rows, one per leaf
+        """
+        sessions = self.analysed
+        leaves = sorted({leaf for r in sessions for leaf in r["leaf_errors"]})
+        header = ["Leaf"] + [r["session"] for r in sessions] + ["Max", "Mean", "Sessions out of tolerance"]
+        rows = []
+        for leaf in leaves:
+            errors = [max(abs(e) for e in r["leaf_errors"][leaf]) if r["leaf_errors"].get(leaf) else None
+                      for r in sessions]
+            found = [e for e in errors if e is not None]
+            if not found:
+                continue
+            rows.append([leaf] + errors + [max(found), sum(found) / len(found),
+                                           sum(e > self.tolerance for e in found)])
+        return header, rows
+
+    def write_csv(self, filename: str):
+        header, rows = self.leaf_table()
+        with open(filename, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for row in rows:
+                writer.writerow([f"{v:.3f}" if isinstance(v, float) else ("" if v is None else v) for v in row])
+
+    def results(self) -> str:
+        lines = [f"{self._model} Results:",
+                 f"MLC: {self.mlc}",
+                 f"Leaf tolerance: {self.tolerance}mm",
+                 f"Sessions analysed: {len(self.analysed)} of {len(self.records)}"]
+        for r in self.records:
+            if "error" in r:
+                lines.append(f"{r['session']}: could not be analysed, {r['error']}")
+            else:
+                lines.append(f"{r['session']}: {'Passed' if r['passed'] else 'Failed'}, "
+                             f"max error {r['max_error_mm']:.3f}mm, "
+                             f"{r['percent_leaves_passing']:.1f}% of leaves passing")
+        header, rows = self.leaf_table()
+        worst = sorted(rows, key=lambda row: row[-3], reverse=True)[:5]
+        if worst:
+            lines.append("Leaves with the largest errors: " +
+                         ", ".join(f"{row[0]} ({row[-3]:.3f}mm)" for row in worst))
+        return "\n".join(lines)
+
+    def results_data(self, as_dict: bool = True) -> dict:
+        return {"mlc": self.mlc, "tolerance_mm": self.tolerance, "sessions": self.records}
+
+    def publish_pdf(self, filename: str, notes: str | list[str] | None = None, metadata: dict | None = None,
+                    logo: str | None = None):
+        """Publish the batch summary and a plot of the leaf errors. The leaf table is written next to the report
+        as a CSV file."""
+        self.write_csv(osp.splitext(filename)[0] + ".csv")
+        canvas = pdf.PylinacCanvas(filename, page_title=f"{self._model} Analysis", metadata=metadata, logo=logo)
+        text = self.results().split("\n")
+        canvas.add_text(text=text[:40], location=(1.5, 25.5), font_size=9)
+        if notes is not None:
+            canvas.add_text(text="Notes:", location=(1, 4.5), font_size=14)
+            canvas.add_text(text=notes, location=(1, 4))
+        canvas.add_new_page()
+        header, rows = self.leaf_table()
+        fig, ax = plt.subplots(figsize=(8, 6))
+        try:
+            for column, session in enumerate(header[1:-3], start=1):
+                ax.plot([row[0] for row in rows], [row[column] for row in rows], ".-", label=session, linewidth=0.8)
+            ax.axhline(self.tolerance, color="red", linestyle="--", label="Tolerance")
+            ax.set_xlabel("Leaf")
+            ax.set_ylabel("Largest absolute error (mm)")
+            ax.set_title("Leaf errors by session")
+            if len(header) - 4 <= 12:
+                ax.legend(fontsize=6)
+            img = io.BytesIO()
+            fig.savefig(img)
+            canvas.add_image(img, location=(1, 5), dimensions=(19, 16))
+        finally:
+            plt.close(fig)
+        canvas.finish()
+
+
+def analyse_batch(filenames: list[str], mlc: str, pf_filter: int | None, params: dict, max_workers: int = 0):
+    """
+    Analyse a batch of picket fence images in a pool of processes. This is a generator that yields a progress
+    message as each image is done, so that it can run in an AnalysisWorker.
+    :param
+    filenames: names of the image files
+    mlc: name of the MLC
+    pf_filter: size of the median filter or None
+    params: keyword parameters for analyze
+    max_workers: maximum number of processes, 0 for one per core
+    :return: PicketFenceBatch
+    """
+    arrangement = mlc_arrangement(mlc)
+    batch = PicketFenceBatch(mlc, params.get("tolerance", 0.5))
+    workers = min(max_workers if max_workers > 0 else os.cpu_count(), len(filenames))
+    yield f"Analysing {len(filenames)} picket fence images"
+    if workers <= 1:
+        for filename in filenames:
+            batch.add(analyse_image(filename, arrangement, pf_filter, params))
+            yield f"Analysed {len(batch.records)} of {len(filenames)} picket fence images"
+        return batch
+    # spawn rather than fork as the GUI has other threads running
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [pool.submit(analyse_image, filename, arrangement, pf_filter, params) for filename in filenames]
+        for future in as_completed(futures):
+            batch.add(future.result())
+            yield f"Analysed {len(batch.records)} of {len(filenames)} picket fence images"
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return batch
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Analyse a batch of picket fence images and tabulate leaf errors.")
+    parser.add_argument("paths", nargs="+", help="DICOM files or directories, directories are searched recursively")
+    parser.add_argument("-o", "--output", help="directory for the report, default is the current directory")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="number of processes, default one per core")
+    parser.add_argument("-m", "--mlc", help="MLC model, default is the one in the LinaQA settings")
+    parser.add_argument("-n", "--notes", help="notes to add to the report")
+    parser.add_argument("-s", "--settings", help="ini file to use instead of the LinaQA settings")
+    args = parser.parse_args(argv)
+
+    matplotlib.use("Agg")
+    start = time.perf_counter()
+    settings = batchunit.open_settings(args.settings)
+    groups, _ = scan_series(batchunit.find_files(args.paths), settings.value("PyDicom/Force", False, type=bool))
+    filenames = [h.filename for series in groups for h in series if h.has_pixels]
+    if not filenames:
+        print("No images found")
+        return 1
+    mlc = args.mlc if args.mlc else settings.value("Picket Fence/MLC Type", "HD Millennium", type=str)
+    pf_filter = 3 if settings.value("Picket Fence/Apply median filter", False, type=bool) else None
+    params = {"tolerance": settings.value("Picket Fence/Leaf Tolerance", 0.5, type=float),
+              "action_tolerance": batchunit.setting_none(settings, "Picket Fence/Leaf Action", 0.25),
+              "num_pickets": batchunit.setting_none(settings, "Picket Fence/Number of pickets", 0, int),
+              "picket_spacing": batchunit.setting_none(settings, "Picket Fence/Picket Spacing", 0, int),
+              "invert": False}
+    stages = analyse_batch(filenames, mlc, pf_filter, params, args.workers)
+    try:
+        while True:
+            print(next(stages), flush=True)
+    except StopIteration as result:
+        batch = result.value
+
+    output_dir = args.output if args.output else os.getcwd()
+    os.makedirs(output_dir, exist_ok=True)
+    name = osp.join(output_dir, f"{batch._model} Analysis")
+    batch.publish_pdf(name + ".pdf",
+                      notes=args.notes.split("\n") if args.notes else None,
+                      metadata=settings.value("General/Metadata"),
+                      logo=settings.value("General/Logo"))
+    with open(name + ".json", "w") as f:
+        json.dump(batch.results_data(), f, indent=2)
+    failed = len(batch.records) - len(batch.analysed)
+    print(f"Analysed {len(batch.records)} images in {time.perf_counter() - start:.1f}s, {failed} failed. "
+          f"Leaf table in {name}.csv")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -17,12 +17,12 @@ from pathlib import Path
 from dataclasses import dataclass
 
 import numpy as np
-from numpy.lib.stride_tricks import sliding_window_view
 from matplotlib import pyplot as plt
 from matplotlib.axes import Axes
 from matplotlib.figure import Figure
 import matplotlib.colors as colors
 from scipy.optimize import curve_fit, minimize
+from scipy.signal import fftconvolve
 from scipy.ndimage import center_of_mass
 from skimage.morphology import isotropic_erosion
 from PyQt5.QtCore import QDate, QTime, QDateTime
@@ -31,46 +31,199 @@ from pydicom import Dataset, dcmread
 
 # We need to monkey patch NMImageStack to accept a dataset. This is bad practice, very bad, but the only
 # workaround I have at the moment.
-from pylinac.core.image import DicomImage, NMImageStack, _rescale_dicom_values
+from pylinac.core.image import DicomImage, BaseImage, NMImageStack, _rescale_dicom_values
 from pylinac.core.geometry import Circle, direction_to_coords
-from pylinac.nuclear import sample_sphere, create_sphere_mask
+from pylinac.nuclear import create_sphere_mask
 import functools
 
+from loaderunit import copy_pixels, release_pixels, pixel_dtype
+
+
+class NMFrame(DicomImage):
+    """A frame of an NMImageStack. The array is a view of the volume of the stack and the metadata is the dataset the
+    frame came from, so making a frame does not decode or copy any pixels."""
+
+    def __init__(self, array: np.ndarray, metadata: Dataset, original_dtype: np.dtype):
+        BaseImage.__init__(self, io.BytesIO())
+        if isinstance(getattr(metadata, "filename", None), str):
+            self.path = metadata.filename
+            self.base_path = os.path.basename(metadata.filename)
+        self._sid = None
+        self._dpi = None
+        self._sad = 1000
+        self.metadata = metadata
+        self._original_dtype = original_dtype
+        self._raw_pixels = False
+        self._invert_pixels = False
+        self.array = array
+
+
+def decode_nm_frames(datasets: list[Dataset], counts: list[int], raw_pixels: bool, dtype=None) -> np.ndarray:
+    """
+    Decode the pixel data of NM datasets into one volume, frames first. Modality LUTs are applied but not the rescale
+    slope and intercept.
+    :param
+    datasets: datasets of the stack
+    counts: number of frames in each dataset
+    raw_pixels: True to leave out the modality LUT
+    dtype: data type of the volume, None for that of the pixel data
+    :return: volume
+    """
+    volume = None
+    start = 0
+    for ds, count in zip(datasets, counts):
+        decoded = getattr(ds, "_pixel_array", None) is not None
+        full_array = ds.pixel_array
+        block = full_array.reshape((count,) + full_array.shape[-2:])
+        if volume is None:
+            volume = np.empty((sum(counts),) + block.shape[1:], dtype=dtype or block.dtype)
+        if not raw_pixels and ds.get("ModalityLUTSequence"):
+            # look up tables are rare in NM so are applied to each dataset in turn
+            block = _rescale_dicom_values(block, ds, raw_pixels, False)
+        volume[start:start + count] = block
+        start += count
+        if not decoded:
+            release_pixels(ds)
+    return volume
+
 
 def patch_nm_image_stack():
     original_init = NMImageStack.__init__
 
     @functools.wraps(original_init)
-    def enhanced_init(self, paths: str | Path | list[Dataset], raw_pixels: bool = False):
+    def enhanced_init(self, paths: str | Path | list[Dataset], raw_pixels: bool = False,
+                      volume: np.ndarray | None = None):
         """The enhanced init has been contracted to a single function to deal with the RAW/Lut case and does
-        not call the original init any more. This means backward compatibility is broken."""
+        not call the original init any more. This means backward compatibility is broken.
+        The pixel data of each dataset is decoded once into a volume for the whole stack, which is rescaled in one
+        pass. The frames are views of the volume. A volume already decoded from the datasets, frames first, e.g. by
+        the Imager, can be given instead. It is shared read only if it needs no rescaling."""
         self.path = paths
-        self.frames = []
-        for path in paths:
-            ds = path if isinstance(path, Dataset) else dcmread(path, force=True)
+        datasets = [path if isinstance(path, Dataset) else dcmread(path, force=True) for path in paths]
+        for ds in datasets:
             if ds.Modality not in ["NM", "PT"]:
                 raise TypeError("The file is not a NM image")
-            full_array = ds.pixel_array
-            # we may have a single dataset with multiple frames
-            if hasattr(ds, "NumberOfFrames") and (ds.NumberOfFrames > 1):
-                for i in range(ds.NumberOfFrames):
-                    array = full_array[i]
-                    img = DicomImage.from_dataset(ds)
-                    img.array = _rescale_dicom_values(array, ds, raw_pixels, False)
-                    self.frames.append(img)
-            # or we may have multiple images with one frame each
-            else:
-                img = DicomImage.from_dataset(ds)
-                img.array = _rescale_dicom_values(full_array, ds, raw_pixels, False)
-                self.frames.append(img)
+        # we may have a single dataset with multiple frames or multiple images with one frame each
+        counts = [ds.NumberOfFrames if hasattr(ds, "NumberOfFrames") and (ds.NumberOfFrames > 1) else 1
+                  for ds in datasets]
+        rescaled = not raw_pixels and any("RescaleSlope" in ds and "RescaleIntercept" in ds for ds in datasets)
+        lut = not raw_pixels and any(ds.get("ModalityLUTSequence") for ds in datasets)
+        slopes = np.ones(sum(counts))
+        intercepts = np.zeros(sum(counts))
+        start = 0
+        for ds, count in zip(datasets, counts):
+            if rescaled and "RescaleSlope" in ds and "RescaleIntercept" in ds and not ds.get("ModalityLUTSequence"):
+                slopes[start:start + count] = ds.RescaleSlope
+                intercepts[start:start + count] = ds.RescaleIntercept
+            start += count
+        if volume is None or lut or len(volume) != sum(counts):
+            volume = decode_nm_frames(datasets, counts, raw_pixels, np.float64 if rescaled else None)
+            if rescaled:
+                volume *= slopes[:, np.newaxis, np.newaxis]
+        elif rescaled:
+            volume = np.multiply(volume, slopes[:, np.newaxis, np.newaxis], out=np.empty(volume.shape))
+        else:
+            # the frames share the volume that was given, which they must not change
+            volume = volume.view()
+            volume.flags.writeable = False
+        if rescaled:
+            volume += intercepts[:, np.newaxis, np.newaxis]
+        self.array = volume
+        self.frames = []
+        start = 0
+        for ds, count in zip(datasets, counts):
+            self.frames += [NMFrame(volume[i], ds, pixel_dtype(ds)) for i in range(start, start + count)]
+            start += count
+        self._views = [frame.array for frame in self.frames]
         self.metadata = ds
 
+    def as_3d_array(self) -> np.ndarray:
+        """The volume of the stack, which is returned without copying unless an analysis has replaced the frames
+        or their arrays."""
+        if len(self.frames) == len(self._views) and all(frame.array is view
+                                                         for frame, view in zip(self.frames, self._views)):
+            return self.array
+        return np.stack([frame.array for frame in self.frames], axis=0)
+
     NMImageStack.__init__ = enhanced_init
+    NMImageStack.as_3d_array = as_3d_array
 
 
 # apply the patch
 patch_nm_image_stack()
 
+from pylinac.core.image import LazyDicomImageStack
+import pylinac.winston_lutz
+
+
+def patch_dicom_image():
+    """Let pylinac images be created directly from a pydicom Dataset. This avoids writing the dataset to a stream
+    and parsing and decoding it again. Subclasses such as the picket fence and Winston-Lutz images and the DICOM
+    image stacks follow as they all end up in DicomImage.__init__. Applying the patch again does nothing."""
+    if getattr(DicomImage.__init__, "linaqa_patched", False):
+        return
+    original_init = DicomImage.__init__
+
+    @functools.wraps(original_init)
+    def enhanced_init(self, path, *, dtype=None, dpi=None, sid=None, sad=1000, raw_pixels=False,
+                      invert_pixels=None):
+        if not isinstance(path, Dataset):
+            original_init(self, path, dtype=dtype, dpi=dpi, sid=sid, sad=sad, raw_pixels=raw_pixels,
+                          invert_pixels=invert_pixels)
+            return
+        # initialise as a stream and then name the image after the file the dataset was read from
+        BaseImage.__init__(self, io.BytesIO())
+        if isinstance(path.filename, str):
+            self.path = path.filename
+            self.base_path = os.path.basename(path.filename)
+        self._sid = sid
+        self._dpi = dpi
+        self._sad = sad
+        # pylinac may change the metadata so give it its own copy of the elements
+        self.metadata = path.copy()
+        array = copy_pixels(path)
+        self._original_dtype = array.dtype
+        self._raw_pixels = raw_pixels
+        self._invert_pixels = invert_pixels
+        if dtype is not None:
+            array = array.astype(dtype)
+        self.array = _rescale_dicom_values(array, self.metadata, raw_pixels=raw_pixels, invert_pixels=invert_pixels)
+
+    enhanced_init.linaqa_patched = True
+    DicomImage.__init__ = enhanced_init
+
+    original_is_image = pylinac.winston_lutz.is_image
+
+    def wl_is_image(path) -> bool:
+        return isinstance(path, Dataset) or original_is_image(path)
+
+    pylinac.winston_lutz.is_image = wl_is_image
+
+    original_get_path_metadatas = LazyDicomImageStack._get_path_metadatas
+
+    @functools.wraps(original_get_path_metadatas)
+    def enhanced_get_path_metadatas(self, paths):
+        if not any(isinstance(path, Dataset) for path in paths):
+            return original_get_path_metadatas(self, paths)
+        # the datasets serve as their own metadata
+        metadata = []
+        matched_paths = []
+        for path in paths:
+            if isinstance(path, Dataset):
+                if ("SOPClassUID" in path) and ("Image Storage" in path.SOPClassUID.name):
+                    metadata.append(path)
+                    matched_paths.append(path)
+            else:
+                file_metadata, file_paths = original_get_path_metadatas(self, [path])
+                metadata += file_metadata
+                matched_paths += file_paths
+        return metadata, matched_paths
+
+    LazyDicomImageStack._get_path_metadatas = enhanced_get_path_metadatas
+
+
+patch_dicom_image()
+
 from pylinac.nuclear import gaussian_fit, TomographicResolutionAxisData
 
 
@@ -92,6 +245,37 @@ def patch_tomo_res_axis_data():
 
 patch_tomo_res_axis_data()
 
+import threading
+
+try:
+    from pylinac.core.warnings import WarningCollectorMixin, capture_warnings
+except ImportError:
+    # older versions of pylinac do not collect warnings
+    WarningCollectorMixin = None
+    capture_warnings = None
+
+
+def patch_warning_collector():
+    """Let pylinac objects that collect warnings be pickled so that they can be analysed in worker processes. The lock
+    guarding the warnings is dropped when pickling and a new one made when unpickling."""
+    if WarningCollectorMixin is None:
+        return
+
+    def getstate(self):
+        state = self.__dict__.copy()
+        state.pop("_warnings_lock", None)
+        return state
+
+    def setstate(self, state):
+        self.__dict__.update(state)
+        self._warnings_lock = threading.Lock()
+
+    WarningCollectorMixin.__getstate__ = getstate
+    WarningCollectorMixin.__setstate__ = setstate
+
+
+patch_warning_collector()
+
 from pylinac.nuclear import (
     Nuclide,
     MaxCountRate,
@@ -103,7 +287,6 @@ from pylinac.nuclear import (
     TomographicResolution,
     TomographicContrast,
     CenterOfRotation,
-    contrast_f,
     TomographicROI,
     get_fov)
 from pylinac.core import pdf
@@ -114,8 +297,8 @@ from pylinac.core.contrast import michelson
 class LinaQAMaxCountRate(MaxCountRate):
     _model = "Maximum Count Rate"
 
-    def __init__(self, path: str | Path | list[Dataset]) -> None:
-        self.stack = NMImageStack(path)
+    def __init__(self, path: str | Path | list[Dataset], volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, volume=volume)
 
     def publish_pdf(
         self,
@@ -264,8 +447,8 @@ class LinaQASimpleSensitivity(SimpleSensitivity):
 class LinaQAPlanarUniformity(PlanarUniformity):
     _model = "Planar Uniformity"
 
-    def __init__(self, path: str | Path | list[Dataset]) -> None:
-        self.stack = NMImageStack(path)
+    def __init__(self, path: str | Path | list[Dataset], volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, volume=volume)
         # self.path = Path(path)
 
     def publish_pdf(
@@ -332,8 +515,8 @@ class LinaQAPlanarUniformity(PlanarUniformity):
 class LinaQAFourBarRes(FourBarResolution):
     _model = "Four Bar Spatial Resolution"
 
-    def __init__(self, path: str | Path | list[Dataset]) -> None:
-        self.stack = NMImageStack(path)
+    def __init__(self, path: str | Path | list[Dataset], volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, volume=volume)
         if isinstance(path[0], Dataset):
             self.path = Path(path[0].filename)
         else:
@@ -400,8 +583,8 @@ class LinaQAFourBarRes(FourBarResolution):
 class LinaQAQuadrantRes(QuadrantResolution):
     _model = "Quadrant Resolution"
 
-    def __init__(self, path: str | Path | list[Dataset]) -> None:
-        self.stack = NMImageStack(path)
+    def __init__(self, path: str | Path | list[Dataset], volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, volume=volume)
         if isinstance(path[0], Dataset):
             self.path = Path(path[0].filename)
         else:
@@ -466,8 +649,8 @@ class LinaQATomoUniformity(TomographicUniformity):
 
     mean_value: float
 
-    def __init__(self, path: str | Path | list[Dataset], raw_pixels: bool) -> None:
-        self.stack = NMImageStack(path, raw_pixels)
+    def __init__(self, path: str | Path | list[Dataset], raw_pixels: bool, volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, raw_pixels, volume)
         if isinstance(path[0], Dataset):
             self.path = Path(path[0].filename)
         else:
@@ -584,8 +767,9 @@ class LinaQATomoUniformity(TomographicUniformity):
 class LinaQATomoResolution(TomographicResolution):
     _model = "Tomographic Resolution"
 
-    def __init__(self, path: str | Path | list[Dataset], raw_pixels: bool = False) -> None:
-        self.stack = NMImageStack(path, raw_pixels)
+    def __init__(self, path: str | Path | list[Dataset], raw_pixels: bool = False,
+                 volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, raw_pixels, volume)
         if isinstance(path[0], Dataset):
             self.path = Path(path[0].filename)
         else:
@@ -658,8 +842,8 @@ class LinaQATomoResolution(TomographicResolution):
 class LinaQACenterOfRotation(CenterOfRotation):
     _model = "Centre of Rotation"
 
-    def __init__(self, path: str | Path | list[Dataset]) -> None:
-        self.stack = NMImageStack(path)
+    def __init__(self, path: str | Path | list[Dataset], volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, volume=volume)
         if isinstance(path[0], Dataset):
             self.path = Path(path[0].filename)
         else:
@@ -725,8 +909,8 @@ class LinaQACenterOfRotation(CenterOfRotation):
 class LinaQATomoContrast(TomographicContrast):
     _model = "Tomographic Contrast"
 
-    def __init__(self, path: str | Path | list[Dataset]) -> None:
-        self.stack = NMImageStack(path)
+    def __init__(self, path: str | Path | list[Dataset], volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, volume=volume)
         if isinstance(path[0], Dataset):
             self.path = Path(path[0].filename)
         else:
@@ -801,43 +985,60 @@ class SUVTomoROI(TomographicROI):
     sphere_dose_vol: float
     pixel_spacing: float
 
-    @property
+    def __post_init__(self):
+        """The statistics are all taken from a box around the sphere, which is cropped and masked once rather than
+        sampling the whole array for each statistic. The box holds the sphere extended by the 1 cc peak window, padded
+        by a further window for the peak correlation."""
+        peak_sphere_radius = 6.20
+        self.window_size = int(peak_sphere_radius * 2 / self.pixel_spacing)     # radius of 1cc sphere is 6.2mm
+        # sample 10 mm beyond sphere radius
+        ext_radius = self.radius + self.window_size
+        self.box = tuple(slice(max(int(np.floor(c - ext_radius)) - self.window_size + 1, 0),
+                               min(int(np.ceil(c + ext_radius)) + self.window_size, n))
+                         for c, n in zip((self.z, self.y, self.x), self.array3d.shape))
+        self.sub_array = self.array3d[self.box]
+        zed, row, col = np.ogrid[self.box]
+        distance2 = (col - self.x) ** 2 + (row - self.y) ** 2 + (zed - self.z) ** 2
+        valid = ~np.isnan(self.sub_array)
+        self.ext_sphere_mask = (distance2 <= ext_radius ** 2) & valid
+        self.sphere_array = np.where(distance2 <= self.radius ** 2, self.sub_array, np.nan)
+
+    @cached_property
+    def sphere_values(self) -> np.ndarray:
+        return self.sphere_array[~np.isnan(self.sphere_array)]
+
+    @cached_property
+    def mean_value(self) -> float:
+        return float(np.mean(self.sphere_values))
+
+    @cached_property
+    def min_value(self) -> float:
+        return float(np.min(self.sphere_values))
+
+    @cached_property
     def max_value(self) -> float:
-        return float(np.nanmax(self.sphere_array))
+        return float(np.max(self.sphere_values))
 
-    @property
+    @cached_property
     def peak_value(self) -> float:
-        """ Strictly speaking this should be a circular window. But the window size will be only 2 or 3 pixels
-        and to make this round is difficult."""
-        peak_sphere_radius = 6.20
-        window_size = int(peak_sphere_radius * 2 / self.pixel_spacing)          # radius of 10cc sphere is 6.2mm
-        window_centre = int(peak_sphere_radius / self.pixel_spacing)
-        # sample 10 mm beyond sphere radius
-        ext_sphere_array = sample_sphere(self.array3d,
-                                         col=self.x, row=self.y, zed=self.z,
-                                         radius=self.radius + window_size)
-        windows = sliding_window_view(ext_sphere_array, (window_size, window_size, window_size))
+        """Largest mean over a 1 cc sphere placed anywhere within the sampled sphere. The means of all the windows
+        are found at once by FFT correlation of the values and of the voxel count with the 1 cc kernel, over the
+        bounding box of the sampled sphere padded by a window, as windows outside it have no values."""
+        window_centre = self.window_size // 2
         # make round, include the pixel if half the pixel is within the sphere radius.
-        mask = create_sphere_mask((window_size, window_size, window_size),
+        mask = create_sphere_mask((self.window_size, self.window_size, self.window_size),
                                   col=window_centre, row=window_centre, zed=window_centre,
                                   radius=window_centre + 0.5)
-        windows_masked = windows.copy()
-        windows_masked[..., ~mask] = np.nan
-        window_means = np.nanmean(windows_masked, axis=(-1, -2, -3))
-        return np.nanmax(window_means)
+        kernel = mask[::-1, ::-1, ::-1].astype(float)
+        sums = fftconvolve(np.where(self.ext_sphere_mask, self.sub_array, 0.0), kernel, mode="valid")
+        counts = np.rint(fftconvolve(self.ext_sphere_mask.astype(float), kernel, mode="valid"))
+        return float(np.max(sums[counts > 0] / counts[counts > 0]))
 
-    @property
+    @cached_property
     def mean_50_value(self) -> float:
-        peak_sphere_radius = 6.20
-        window_size = int(peak_sphere_radius * 2 / self.pixel_spacing)          # radius of 10cc sphere is 6.2mm
-        # sample 10 mm beyond sphere radius
-        ext_sphere_array = sample_sphere(self.array3d,
-                                         col=self.x, row=self.y, zed=self.z,
-                                         radius=self.radius + window_size)
-        # threshold to 50%
-        threshold = self.max_value * 0.50
-        ext_sphere_array[ext_sphere_array <= threshold] = np.nan
-        return np.nanmean(ext_sphere_array)
+        # mean of the extended sphere thresholded to 50%
+        values = self.sub_array[self.ext_sphere_mask]
+        return float(np.mean(values[values > self.max_value * 0.50]))
 
     @property
     def mean_contrast(self) -> float:
@@ -890,13 +1091,65 @@ class SUVTomoROI(TomographicROI):
         return scan / measured
 
 
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+
+def cropped_contrast_f(coords: np.ndarray, sub_array: np.ndarray, origin: tuple[int, int, int], radius: float,
+                       uniformity_baseline: float) -> float:
+    """contrast_f on a sub-volume of the array. Coordinates are those of the full array, origin is the (col, row,
+    zed) of the first voxel of the sub-volume. Gives the same value as contrast_f as long as the sphere lies within the
+    sub-volume."""
+    col, row, zed = coords
+    mask = create_sphere_mask(sub_array.shape, col=col - origin[0], row=row - origin[1], zed=zed - origin[2],
+                              radius=radius)
+    return -michelson(np.asarray([np.nanmean(sub_array[mask]), uniformity_baseline])) * 100
+
+
+def locate_sphere(array: np.ndarray, x0: tuple[float, float, float], bounds: list[tuple[float, float]],
+                  radius: float, uniformity_baseline: float) -> tuple[float, float, float]:
+    """
+    Find the sphere centre that gives the highest contrast by searching within bounds. Only the sub-volume that the
+    sphere can reach from within the bounds is sampled.
+    :param
+    array: 3D array of the image
+    x0: starting (col, row, zed) of the sphere
+    bounds: (min, max) of the col, row and zed to search
+    radius: sphere radius in pixels
+    uniformity_baseline: mean background value
+    :return: (col, row, zed) of the sphere centre
+    """
+    # bounds are (col, row, zed), the array is indexed (zed, row, col)
+    box = [slice(max(int(np.floor(low - radius)), 0), min(int(np.ceil(high + radius)) + 1, n))
+           for (low, high), n in zip(bounds, array.shape[::-1])]
+    sub_array = array[box[2], box[1], box[0]]
+    res = minimize(
+        cropped_contrast_f,
+        x0=x0,
+        args=(sub_array, tuple(b.start for b in box), radius, uniformity_baseline),
+        method="Nelder-Mead",
+        bounds=bounds,
+    )
+    return tuple(float(c) for c in res.x)
+
+
+def _locate_shared_sphere(name: str, shape: tuple, dtype: str, *args) -> tuple[float, float, float]:
+    # locate a sphere in a worker process, the array is read from shared memory rather than pickled
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return locate_sphere(np.ndarray(shape, dtype=dtype, buffer=shm.buf), *args)
+    finally:
+        shm.close()
+
+
 class SUVUptake:
     """Use the methods detailed here for SUV calculation
     https://qibawiki.rsna.org/index.php/Standardized_Uptake_Value_(SUV)"""
     _model = "SUV Uptake"
 
-    def __init__(self, path: str | Path | list[Dataset]) -> None:
-        self.stack = NMImageStack(path)
+    def __init__(self, path: str | Path | list[Dataset], volume: np.ndarray | None = None) -> None:
+        self.stack = NMImageStack(path, volume=volume)
         self.scaled_3d_array = self.stack.as_3d_array()
         if isinstance(path[0], Dataset):
             self.path = Path(path[0].filename)
@@ -949,6 +1202,24 @@ class SUVUptake:
         return {"mean": backgnd_slices[:, self.backgnd_roi].mean(),
                 "stddev": backgnd_slices[:, self.backgnd_roi].std()}
 
+    def _locate_spheres(self, searches: list[tuple], max_workers: int) -> list[tuple[float, float, float]]:
+        # each sphere is searched for independently, so the searches are spread over a pool of processes
+        workers = min(max_workers if max_workers > 0 else os.cpu_count(), len(searches))
+        if workers <= 1:
+            return [locate_sphere(self.scaled_3d_array, *search) for search in searches]
+        array = self.scaled_3d_array
+        shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        try:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+            # spawn rather than fork as the GUI has other threads running
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                futures = [pool.submit(_locate_shared_sphere, shm.name, array.shape, array.dtype.str, *search)
+                           for search in searches]
+                return [future.result() for future in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+
     def analyze(
         self,
         sphere_diameters_mm: Sequence[float] = (37.0, 28.0, 22.0, 17.0, 13.0, 10.0),
@@ -962,7 +1233,8 @@ class SUVUptake:
         sphere_dose: float | None = None,
         sphere_time: QTime = QTime.fromString("12:00:00", "hh:mm:ss"),
         measurement_time: QTime | None = None,
-        use_50_vol: bool = False
+        use_50_vol: bool = False,
+        max_workers: int = 1
     ) -> None:
         """Analyze the image to determine the contrast.
 
@@ -992,6 +1264,10 @@ class SUVUptake:
             Time the scan series was done. If None taken from series metadata.
         use_50_vol: bool
             Use sphere volume thresholded to 50% of peak value if True, otherwise use physical sphere volume.
+        max_workers: int = 1
+            Maximum number of processes to search for the spheres with, 0 for one per core and 1 to search for the
+            spheres one after another. Each search only samples the volume around its sphere and takes a fraction of
+            a second, so a pool only pays for starting its processes with large volumes or many spheres.
         """
         self.use_50_vol = use_50_vol
         if len(sphere_diameters_mm) != len(sphere_angles):
@@ -1041,26 +1317,24 @@ class SUVUptake:
         # can also use
         # sphere_radius = 11.4/(2*self.stack.metadata.PixelSpacing[0])
 
-        rois = {}
-        for idx, (angle, diameter) in enumerate(zip(sphere_angles, sphere_diameters_mm)):
+        searches = []
+        for angle, diameter in zip(sphere_angles, sphere_diameters_mm):
             radius = diameter / (2 * metadata.PixelSpacing[0])
             col_x, row_y = direction_to_coords(self.phantom_center[1], self.phantom_center[0], sphere_radius, angle)
             # quicker but less accurate at the smallest ROIs
-            res = minimize(
-                contrast_f,
-                x0=(col_x, row_y, self.sphere_slice_index),
-                args=(self.scaled_3d_array, radius, self.backgnd["mean"]),
-                method="Nelder-Mead",
-                bounds=[
-                    (col_x - search_window_px, col_x + search_window_px),
-                    (row_y - search_window_px, row_y + search_window_px),
-                    (self.sphere_slice_index - search_slices, self.sphere_slice_index + search_slices),
-                ],
-            )
+            searches.append(((col_x, row_y, self.sphere_slice_index),
+                             [(col_x - search_window_px, col_x + search_window_px),
+                              (row_y - search_window_px, row_y + search_window_px),
+                              (self.sphere_slice_index - search_slices, self.sphere_slice_index + search_slices)],
+                             radius,
+                             self.backgnd["mean"]))
             # alternatives left for future potential work
             # res = brute(contrast_f, ranges=[(col_x - search_window_px, col_x + search_window_px), (row_y - search_window_px, row_y + search_window_px), (unif_z - search_slices, unif_z + search_slices)], args=(array3d, radius, self.uniformity_value), Ns=search_window_px*2, full_output=False, finish=None)
             # res = differential_evolution(contrast_f, bounds=[(col_x - search_window_px, col_x + search_window_px), (row_y - search_window_px, row_y + search_window_px), (unif_z - search_slices, unif_z + search_slices)], args=(array3d, radius, self.uniformity_value), polish=False, x0=(col_x, row_y, unif_z), seed=1234)
-            col, row, zed = res.x
+        centres = self._locate_spheres(searches, max_workers)
+
+        rois = {}
+        for idx, ((col, row, zed), (_, _, radius, _)) in enumerate(zip(centres, searches)):
             roi = SUVTomoROI(
                 array3d=self.scaled_3d_array,
                 x=col,
@@ -1240,3 +1514,96 @@ class SUVUptake:
         figs[0].savefig(analysis_image)
         canvas.add_image(analysis_image, location=(1, 0), dimensions=(15, 15), preserve_aspect_ratio=True)
         canvas.finish()
+
+
+import itertools
+from pylinac.winston_lutz import WinstonLutz, MachineScale, BBArrangement, BB3D
+
+
+def _analyze_wl_image(wl_image, kwargs: dict):
+    # find the BB and field in one Winston-Lutz image in a worker process
+    wl_image.analyze(**kwargs)
+    return wl_image
+
+
+class LinaQAWinstonLutz(WinstonLutz):
+    """Winston-Lutz test that finds the BB and field in each image in a pool of processes. Only the isocentre fit is
+    done once all the images have been analysed, so the results are the same as for WinstonLutz."""
+
+    _model = "Winston-Lutz"
+
+    def _analyze_images(self, max_workers: int, **kwargs):
+        workers = min(max_workers if max_workers > 0 else os.cpu_count(), len(self.images))
+        if workers <= 1:
+            for img in self.images:
+                img.analyze(**kwargs)
+            return
+        # spawn rather than fork as the GUI has other threads running
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            self.images = list(pool.map(_analyze_wl_image, self.images, itertools.repeat(kwargs)))
+        if WarningCollectorMixin is not None:
+            # warnings in the workers are not seen here, so collect them from the images as a serial run would
+            for img in self.images:
+                self._add_warnings(img.get_captured_warnings())
+
+    def analyze(
+        self,
+        bb_size_mm: float = 5,
+        machine_scale: MachineScale = MachineScale.IEC61217,
+        low_density_bb: bool = False,
+        open_field: bool = False,
+        apply_virtual_shift: bool = False,
+        snap_tolerance: float = 3,
+        gantry_reference: float = 0,
+        collimator_reference: float = 0,
+        couch_reference: float = 0,
+        bb_proximity_mm: float = 20,
+        max_workers: int = 0,
+    ) -> None:
+        """Analyze the WL images. See WinstonLutz.analyze for the parameters.
+        :param
+        max_workers: maximum number of processes to analyse the images with, 0 for one per core and 1 to analyse
+        them one after another
+        """
+        self.machine_scale = machine_scale
+        if self.is_from_cbct:
+            low_density_bb = True
+            open_field = True
+        self._analyze_images(max_workers,
+                             bb_size_mm=bb_size_mm,
+                             low_density_bb=low_density_bb,
+                             open_field=open_field,
+                             snap_tolerance=snap_tolerance,
+                             gantry_reference=gantry_reference,
+                             collimator_reference=collimator_reference,
+                             couch_reference=couch_reference,
+                             bb_proximity_mm=bb_proximity_mm,
+                             machine_scale=machine_scale)
+        bb_config = BBArrangement.ISO[0]
+        bb_config.bb_size_mm = bb_size_mm
+        self.bb = BB3D(bb_config=bb_config,
+                       bb_matches=[img.arrangement_matches["Iso"] for img in self.images],
+                       scale=self.machine_scale)
+        self._virtual_shift = None
+        if apply_virtual_shift:
+            shift = self.bb_shift_vector
+            self._virtual_shift = shift
+            self._analyze_images(max_workers,
+                                 bb_size_mm=bb_size_mm,
+                                 low_density_bb=low_density_bb,
+                                 open_field=open_field,
+                                 shift_vector=shift,
+                                 snap_tolerance=snap_tolerance,
+                                 gantry_reference=gantry_reference,
+                                 collimator_reference=collimator_reference,
+                                 couch_reference=couch_reference,
+                                 machine_scale=machine_scale)
+            self.bb = BB3D(bb_config=bb_config,
+                           bb_matches=[img.arrangement_matches["Iso"] for img in self.images],
+                           scale=self.machine_scale)
+        self._is_analyzed = True
+        self._bb_diameter = bb_size_mm
+
+
+if capture_warnings is not None:
+    LinaQAWinstonLutz = capture_warnings(LinaQAWinstonLutz)
@@ -17,6 +17,7 @@ from PyQt5.QtWidgets import (
     QLabel,
     QFrame,
     QStatusBar,
+    QProgressBar,
     QDoubleSpinBox)
 from PyQt5.QtCore import QTimer, Qt, pyqtSignal, QEvent
 from PyQt5.QtGui import QPalette
@@ -25,6 +26,36 @@ from linaqa_types import faint_red, faint_green, faint_yellow
 
 class ColorStatusBar(QStatusBar):
     """Status bar to display and retain colour coded error, warn and good messages"""
+
+    cancel_requested = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # busy indicator and cancel button for analyses running in the background
+        self.busy_bar = QProgressBar()
+        self.busy_bar.setRange(0, 0)
+        self.busy_bar.setMaximumWidth(120)
+        self.busy_bar.setTextVisible(False)
+        self.cancel_button = QToolButton()
+        self.cancel_button.setText("Cancel")
+        self.cancel_button.setToolTip("Cancel the running analysis")
+        self.cancel_button.clicked.connect(self.cancel_requested)
+        self.addPermanentWidget(self.busy_bar)
+        self.addPermanentWidget(self.cancel_button)
+        self.busy_bar.hide()
+        self.cancel_button.hide()
+
+    def show_busy(self, status_message):
+        # Show the message with the busy indicator
+        self.status_message(status_message)
+        self.busy_bar.show()
+        self.cancel_button.show()
+
+    def hide_busy(self):
+        self.busy_bar.hide()
+        self.cancel_button.hide()
+        self.cancel_button.setEnabled(True)
+
     def status_clear(self):
         # Clear the status bar
         qsb_color = self.palette().color(QPalette.Base).getRgb()
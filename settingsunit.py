@@ -35,6 +35,8 @@ def set_default_settings(settings):
         settings.setValue("Logo", logo_path)
     if not settings.contains("Metadata"):
         settings.setValue("Metadata", {"Physicist": "", "Linac": ""})
+    if not settings.contains("Result cache MB"):
+        settings.setValue("Result cache MB", "512")
     settings.endGroup()
 
     settings.beginGroup("3D Phantoms")
@@ -61,6 +63,8 @@ def set_default_settings(settings):
         settings.setValue("Apply median filter", "False")
     if not settings.contains("Picket Spacing"):
         settings.setValue("Picket Spacing", "0")
+    if not settings.contains("Max workers"):
+        settings.setValue("Max workers", "0")
     settings.endGroup()
 
     settings.beginGroup("Star shot")
@@ -90,6 +94,8 @@ def set_default_settings(settings):
         settings.setValue("Open field", "False")
     if not settings.contains("Low density BB"):
         settings.setValue("Low density BB", "False")
+    if not settings.contains("Max workers"):
+        settings.setValue("Max workers", "0")
     settings.endGroup()
 
     settings.beginGroup("2D Phantoms")
@@ -129,6 +135,18 @@ def set_default_settings(settings):
         settings.setValue("Use rescale", "False")
     if not settings.contains("Scale factor"):
         settings.setValue("Scale factor", "1.0")
+    if not settings.contains("Load threads"):
+        settings.setValue("Load threads", "0")
+    if not settings.contains("Use catalog"):
+        settings.setValue("Use catalog", "True")
+    if not settings.contains("Lazy loading"):
+        settings.setValue("Lazy loading", "True")
+    if not settings.contains("Slice cache"):
+        settings.setValue("Slice cache", "32")
+    if not settings.contains("Prefetch slices"):
+        settings.setValue("Prefetch slices", "4")
+    if not settings.contains("Memory map above MB"):
+        settings.setValue("Memory map above MB", "1024")
     settings.endGroup()
 
     settings.beginGroup("Window")
@@ -219,6 +237,8 @@ def set_default_settings(settings):
         settings.setValue("Stock dose", "20")
     if not settings.contains("Mean area"):
         settings.setValue("Mean area", "Physical vol")
+    if not settings.contains("Max workers"):
+        settings.setValue("Max workers", "1")
     settings.endGroup()
 
 
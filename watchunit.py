@@ -0,0 +1,323 @@
+"""
+===========================
+Watch folders for QA images
+===========================
+
+Long running watcher that analyses QA images as they are exported to shared folders. The folders are polled and a
+folder is taken to be complete once no file in it has changed for a settling time. The new series in it are then
+classified by modality and DICOM tags into the right analysis and queued onto a bounded pool of worker processes. The
+analyses are run by batchunit, so the reports, results and settings are the same as for a batch.
+Usage: python watchunit.py /path/to/epid=picket-fence /path/to/ct [-o /path/to/reports]
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+import os
+import os.path as osp
+import sys
+import re
+import json
+import time
+import signal
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import matplotlib
+import pydicom
+
+from loaderunit import DicomHeader, scan_series
+import batchunit
+
+# analysis for words or phrases in the series description or protocol name of nuclear medicine images
+nm_keywords = [
+    ("count rate", "max-count-rate"),
+    ("sensitivity", "simple-sensitivity"),
+    ("centre of rotation", "centre-of-rotation"),
+    ("center of rotation", "centre-of-rotation"),
+    ("cor", "centre-of-rotation"),
+    ("bar", "spatial-resolution"),
+    ("jaszczak", "tomographic-contrast"),
+    ("contrast", "tomographic-contrast"),
+]
+
+# analysis for the NM image type, the third value of ImageType
+nm_image_types = {
+    "STATIC": "planar-uniformity",
+    "DYNAMIC": "max-count-rate",
+    "TOMO": "centre-of-rotation",
+    "RECON TOMO": "tomographic-uniformity",
+}
+
+
+def classify(series: list[DicomHeader]) -> str | None:
+    """
+    Choose the analysis for a series from its modality and DICOM tags.
+    :param
+    series: headers of the files in the series
+    :return: name of the analysis in batchunit.analyses or None if the series is not recognised
+    """
+    modality = series[0].modality
+    if modality == "CT":
+        return "catphan"
+    if modality == "RTIMAGE":
+        # a set of images at different gantry angles is a Winston-Lutz test
+        return "winston-lutz" if len(series) > 1 else "picket-fence"
+    if modality == "PT":
+        return "suv-uptake"
+    if modality == "NM":
+        try:
+            ds = pydicom.dcmread(series[0].filename, stop_before_pixels=True)
+        except (pydicom.errors.InvalidDicomError, OSError):
+            return None
+        description = f" {ds.get('SeriesDescription', '')} {ds.get('ProtocolName', '')} ".lower()
+        description = re.sub(r"[^a-z0-9]+", " ", description)
+        image_type = list(ds.get("ImageType", []))
+        recon = len(image_type) > 2 and image_type[2] == "RECON TOMO"
+        for keyword, analysis in nm_keywords:
+            if f" {keyword} " in description:
+                if analysis == "spatial-resolution" and recon:
+                    return "tomographic-resolution"
+                return analysis
+        if "resolution" in description:
+            return "tomographic-resolution" if recon else "spatial-resolution"
+        if len(image_type) > 2:
+            return nm_image_types.get(image_type[2])
+    return None
+
+
+@dataclass
+class WatchStats:
+    """Throughput and queue statistics written to watch_stats.json for monitoring"""
+    started: float = field(default_factory=time.time)
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    unrecognised: int = 0
+    analysis_seconds: float = 0.0
+    last_result: dict = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        elapsed_hours = max(time.time() - self.started, 1) / 3600
+        done = self.completed + self.failed
+        return {"started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "unrecognised": self.unrecognised,
+                "series_per_hour": round(done / elapsed_hours, 2),
+                "mean_analysis_seconds": round(self.analysis_seconds / done, 2) if done else 0.0,
+                "last_result": self.last_result}
+
+
+class Watcher:
+    """
+    Poll folders for new DICOM files and analyse each new series once.
+    :param
+    folders: dictionary of folder: analysis, analysis None to classify each series
+    output_dir: directory for the reports and the monitoring files
+    workers: number of worker processes, 0 for one per core
+    max_queue: number of series waiting for a worker. Folders are left until there is room.
+    settle: seconds a folder must be unchanged before it is analysed
+    settings_file: optional ini file to use instead of the LinaQA settings
+    """
+
+    def __init__(self, folders: dict, output_dir: str, workers: int = 0, max_queue: int = 32, settle: float = 30,
+                 settings_file: str | None = None, notes: str | None = None, log=print):
+        self.folders = folders
+        self.output_dir = output_dir
+        self.workers = workers if workers > 0 else os.cpu_count()
+        self.max_queue = max_queue
+        self.settle = settle
+        self.settings_file = settings_file
+        self.notes = notes
+        self.log = log
+        self.settings = batchunit.open_settings(settings_file)
+        self.force_read = self.settings.value("PyDicom/Force", False, type=bool)
+        self.stats = WatchStats()
+        self.state_file = osp.join(output_dir, "watch_state.json")
+        self.stats_file = osp.join(output_dir, "watch_stats.json")
+        # files already dealt with, keyed on filename with the modification time and size they had, and the number
+        # of jobs started so far, which numbers the reports of multi file series
+        self.seen = {}
+        self.job_count = 0
+        if osp.exists(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if "seen" not in state:
+                # state saved before the job count was kept
+                state = {"seen": state}
+            self.seen = {k: tuple(v) for k, v in state["seen"].items()}
+            self.job_count = state.get("job_count", 0)
+        self.pending = deque()
+        self.running = {}
+        self.waiting = 0
+        self.pool = None
+
+    def new_files(self, folder: str) -> dict:
+        # files in the folder that have not been dealt with, with their modification time and size
+        files = {}
+        for root, dirs, names in os.walk(folder):
+            dirs.sort()
+            for name in sorted(names):
+                path = osp.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if self.seen.get(path) != (st.st_mtime, st.st_size):
+                    files[path] = (st.st_mtime, st.st_size)
+        return files
+
+    def poll(self):
+        # queue the series in each folder that has settled, series that do not fit in the queue are left for the
+        # next poll
+        now = time.time()
+        self.waiting = 0
+        for folder, analysis in self.folders.items():
+            files = self.new_files(folder)
+            if not files:
+                continue
+            if len(self.pending) >= self.max_queue or now - max(mtime for mtime, _ in files.values()) < self.settle:
+                self.waiting += 1
+                continue
+            groups, _ = scan_series(list(files), self.force_read)
+            held = set()
+            for series in groups:
+                if not any(h.has_pixels for h in series):
+                    continue
+                series_analysis = analysis if analysis else classify(series)
+                room = max(self.max_queue - len(self.pending), 0)
+                if series_analysis is None:
+                    self.stats.unrecognised += 1
+                    self.log(f"No analysis for {series[0].modality} series {series[0].filename}")
+                elif batchunit.analyses[series_analysis][1]:
+                    images = [h for h in series if h.has_pixels]
+                    self.pending.extend((series_analysis, [h]) for h in images[:room])
+                    held.update(h.filename for h in images[room:])
+                elif room:
+                    self.pending.append((series_analysis, series))
+                else:
+                    held.update(h.filename for h in series)
+            self.seen.update((path, stat) for path, stat in files.items() if path not in held)
+            if held:
+                self.waiting += 1
+        self.stats.queued = len(self.pending)
+
+    def dispatch(self):
+        # keep the workers busy without holding more than one waiting job per worker in the pool
+        while self.pending and len(self.running) < 2 * self.workers:
+            analysis, series = self.pending.popleft()
+            future = self.pool.submit(batchunit.run_job, analysis, series, self.job_count, self.output_dir,
+                                      self.notes, self.force_read)
+            self.running[future] = (analysis, series)
+            self.job_count += 1
+        self.collect()
+
+    def collect(self):
+        # record the jobs that have finished, cancelled jobs are left in running
+        for future in [f for f in self.running if f.done() and not f.cancelled()]:
+            analysis, series = self.running.pop(future)
+            try:
+                record = future.result()
+            except BaseException as e:
+                # e.g. a worker process that died, the job is recorded as failed rather than stopping the watcher
+                record = {"analysis": analysis, "files": [h.filename for h in series], "status": "error",
+                          "error": repr(e), "seconds": 0}
+            if record["status"] == "ok":
+                self.stats.completed += 1
+            else:
+                self.stats.failed += 1
+            self.stats.analysis_seconds += record["seconds"]
+            self.stats.last_result = {"analysis": record["analysis"],
+                                      "status": record["status"],
+                                      "file": record["files"][0],
+                                      "report": record.get("pdf", record.get("error")),
+                                      "seconds": record["seconds"]}
+            self.log(f"{record['status']} {record['analysis']} {record['seconds']}s {record['files'][0]}: "
+                     f"{record.get('pdf', record.get('error'))}")
+            with open(osp.join(self.output_dir, "watch_results.jsonl"), "a") as f:
+                f.write(json.dumps(record) + "\n")
+        self.stats.queued = len(self.pending)
+        self.stats.running = len(self.running)
+
+    def save(self):
+        with open(self.state_file, "w") as f:
+            json.dump({"seen": self.seen, "job_count": self.job_count}, f)
+        with open(self.stats_file, "w") as f:
+            json.dump(self.stats.as_dict(), f, indent=2)
+
+    def run(self, interval: float = 5, once: bool = False):
+        """
+        Watch until interrupted.
+        :param
+        interval: seconds between polls
+        once: analyse what is there now, wait for it to finish and stop
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                        initializer=init_worker,
+                                        initargs=(self.settings_file,))
+        try:
+            while True:
+                self.poll()
+                self.dispatch()
+                self.save()
+                if once and not self.pending and not self.running and not self.waiting:
+                    break
+                time.sleep(interval if not once else 0.1)
+        except KeyboardInterrupt:
+            self.log("Stopping, waiting for running analyses to finish")
+        finally:
+            try:
+                # no new jobs are started, the running ones are finished and those waiting in the pool cancelled
+                self.pool.shutdown(wait=True, cancel_futures=True)
+                self.collect()
+            finally:
+                # anything not analysed is picked up again on the next start
+                for _, series in list(self.running.values()) + list(self.pending):
+                    for h in series:
+                        self.seen.pop(h.filename, None)
+                self.save()
+
+
+def init_worker(settings_file: str | None):
+    # <ctrl>-C is for the watcher, which lets the running analyses finish before it stops
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    batchunit.init_worker(settings_file)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Watch folders and analyse new QA images as they arrive.")
+    parser.add_argument("folders", nargs="+",
+                        help="folders to watch, add =analysis to a folder to use that analysis for everything in it")
+    parser.add_argument("-o", "--output", required=True, help="directory for the reports and monitoring files")
+    parser.add_argument("-w", "--workers", type=int, default=0, help="number of processes, default one per core")
+    parser.add_argument("-q", "--max-queue", type=int, default=32, help="number of series waiting for a worker")
+    parser.add_argument("--settle", type=float, default=30, help="seconds a folder must be unchanged")
+    parser.add_argument("--interval", type=float, default=5, help="seconds between polls")
+    parser.add_argument("--once", action="store_true", help="analyse what is there now and stop")
+    parser.add_argument("-n", "--notes", help="notes to add to each report")
+    parser.add_argument("-s", "--settings", help="ini file to use instead of the LinaQA settings")
+    args = parser.parse_args(argv)
+
+    folders = {}
+    for folder in args.folders:
+        path, _, analysis = folder.partition("=")
+        if analysis and analysis not in batchunit.analyses:
+            parser.error(f"unknown analysis {analysis}, choose from {', '.join(batchunit.analyses)}")
+        folders[path] = analysis if analysis else None
+
+    matplotlib.use("Agg")
+    watcher = Watcher(folders, args.output, args.workers, args.max_queue, args.settle, args.settings, args.notes,
+                      log=lambda message: print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message}", flush=True))
+    watcher.run(args.interval, args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""
+==============================
+Background analysis for LinaQA
+==============================
+"""
+# author : AC Chamberlain <alanphys@yahoo.co.uk>
+# copyright: AC Chamberlain (c) 2023-2026
+# SPDX-License-Identifier: Licence.txt:
+
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+from cacheunit import analysis_key, analysis_size
+
+
+class WorkerSignals(QObject):
+    """Signals from an analysis worker. They are delivered in the thread that owns the receiver, i.e. the GUI."""
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(object)
+    error = pyqtSignal(object)
+    cancelled = pyqtSignal()
+
+
+class AnalysisWorker(QRunnable):
+    """
+    Runs an analysis on a QThreadPool thread.
+    The analysis is a generator function that yields a progress message before each stage and returns its result.
+    Cancelling takes effect at the end of the stage that is running, as pylinac cannot be interrupted mid stage.
+    If a ResultCache is given and holds the result of the same analysis of the same images it is returned directly.
+    """
+
+    def __init__(self, function, *args, **kwargs):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.is_cancelled = False
+        self.cache = None
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def run(self):
+        try:
+            key = None
+            # only hash the images if their results could be kept
+            size = analysis_size((self.args, self.kwargs)) if self.cache is not None else 0
+            if self.cache is not None and self.cache.fits(size):
+                self.signals.progress.emit("Checking for previous results")
+                key = analysis_key(self.function, (self.args, self.kwargs))
+                result = self.cache.get(key)
+                if result is not None:
+                    self.signals.progress.emit("Using previous results")
+                    self.signals.finished.emit(result)
+                    return
+            stages = self.function(*self.args, **self.kwargs)
+            while True:
+                if self.is_cancelled:
+                    stages.close()
+                    self.signals.cancelled.emit()
+                    return
+                try:
+                    message = next(stages)
+                except StopIteration as result:
+                    if key is not None:
+                        self.cache.put(key, result.value, size)
+                    self.signals.finished.emit(result.value)
+                    return
+                self.signals.progress.emit(message)
+        except Exception as e:
+            self.signals.error.emit(e)